@@ -2,11 +2,25 @@
 # Patrick Pinard - 2024
 
 
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, Response, request, session, g, make_response
 import requests
+from requests.adapters import HTTPAdapter
 import os, time
 from flask_cors import CORS
 import json
+import re
+import gzip
+import hashlib
+import threading
+import queue
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from history import HistoryStore, parse_time
+
+try:
+    import websocket             # websocket-client : canal de commande persistant vers le Pico
+except ImportError:
+    websocket = None             # commandes en HTTP uniquement
 
 
 app = Flask(__name__)
@@ -15,6 +29,11 @@ app.secret_key = os.urandom(12)
 
 URL_PICO = "http://192.168.1.109"
 
+# Cartes relais gérées par le gateway : nom -> URL (la première est la carte par défaut)
+BOARDS = {
+    "pico": URL_PICO,
+}
+
 default_relays=[{"5": False, "4": False, "7": False, "6": False, "1": False, "8": False, "3": False, "2": False}]
 
 default_system = {'ip_address': "unknown",
@@ -32,10 +51,92 @@ default_system = {'ip_address': "unknown",
 ###### PWA files  ########
 
 
+# Fichiers statiques utilisés par le dashboard, précachés par le Service Worker
+# (les icônes du manifeste sont ajoutées automatiquement)
+PRECACHE_STATIC = [
+    "css/style.css",
+    "css/src/bootstrap/bootstrap.min.css",
+    "css/src/splide/splide.min.css",
+    "js/base.js",
+    "js/plugins/apexcharts/apexcharts.min.js",
+    "img/favicon-32x32.png",
+    "img/favicon-96x96.png",
+    "img/favicon-196x196.png",
+    "img/loading-icon.png",
+]
+
+# Librairies chargées depuis un CDN par layout.html et style.css
+PRECACHE_EXTERNAL = [
+    "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+    "https://unpkg.com/ionicons@5.5.2/dist/ionicons/ionicons.js",
+    "https://unpkg.com/ionicons@4.5.10-0/dist/css/ionicons.min.css",
+    "https://cdnjs.cloudflare.com/ajax/libs/jquery/3.7.1/jquery.min.js",
+    "https://cdnjs.cloudflare.com/ajax/libs/bootstrap/5.3.0/js/bootstrap.bundle.min.js",
+    "https://fonts.googleapis.com/css?family=Poppins:400,500,600&display=swap",
+]
+
+# Pages et API servies "stale-while-revalidate" par le Service Worker (max-age en s).
+# Avec plusieurs cartes, la carte affichée dépend de la session et non de l'URL :
+# pages et API ne sont alors pas mises en cache (voir precache_manifest())
+PRECACHE_PAGES = ["/", "/relais", "/system", "/events", "/parameters"]
+SW_PAGE_MAX_AGE = 30
+SW_API = {"/get_relay_state": 5}
+
+precache = {"stamp": None, "manifest": None}
+
+
+def precache_manifest():
+    """
+    Retourne le manifeste de précache du Service Worker. Sa version est un
+    hash du contenu des fichiers : elle change à chaque modification d'un
+    fichier statique ou du Service Worker, ce qui force la mise à jour du
+    cache des navigateurs. Avec plusieurs cartes, seuls les fichiers
+    statiques sont mis en cache : une page en cache sous son URL pourrait
+    afficher une autre carte que celle de la session.
+    """
+    cache_pages = len(BOARDS) == 1
+    with open(os.path.join(app.static_folder, "__manifest.json")) as f:
+        icons = [icon["src"] for icon in json.load(f)["icons"]]
+    files = ["__service-worker.js", "__manifest.json"]
+    files += ["static/" + path for path in PRECACHE_STATIC] + icons
+    files = list(dict.fromkeys(files))
+
+    paths = [os.path.join(app.static_folder, f[len("static/"):] if f.startswith("static/") else f)
+             for f in files]
+    stamp = (cache_pages,) + tuple(os.stat(path).st_mtime_ns for path in paths)
+    if precache["stamp"] != stamp:
+        digest = hashlib.sha1()
+        for name, path in zip(files, paths):
+            digest.update(name.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        digest.update(repr((PRECACHE_EXTERNAL, PRECACHE_PAGES, SW_PAGE_MAX_AGE, SW_API, cache_pages)).encode())
+        precache["manifest"] = {
+            "version": digest.hexdigest()[:12],
+            "assets": ["/" + f for f in files if f != "__service-worker.js"],
+            "external": PRECACHE_EXTERNAL,
+            "cache_pages": cache_pages,
+            "pages": PRECACHE_PAGES if cache_pages else [],
+            "page_max_age": SW_PAGE_MAX_AGE,
+            "api": SW_API if cache_pages else {},
+        }
+        precache["stamp"] = stamp
+    return precache["manifest"]
+
+
 @app.route("/__service-worker.js", methods=["GET"])
 def serviceworker():
-
-    return app.send_static_file("__service-worker.js")
+    """
+    Sert le Service Worker précédé de son manifeste de précache versionné
+    """
+    manifest = precache_manifest()
+    with open(os.path.join(app.static_folder, "__service-worker.js")) as f:
+        source = f.read()
+    response = Response("self.__PRECACHE_MANIFEST = %s;\n%s" % (json.dumps(manifest), source),
+                        mimetype="text/javascript")
+    response.set_etag(manifest["version"])
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 
 @app.route("/__manifest.json", methods=["GET"])
@@ -43,30 +144,1112 @@ def manifest():
 
     return app.send_static_file("__manifest.json")
 
-def is_connected():
+###### Metrics  ########
 
-    url = URL_PICO + "/is_connected"
-    
-    try:
-        response = requests.get(url,timeout=3)
-        return True 
-    except :
-        return False
 
+class Metrics(object):
+    """
+    Compteurs et histogrammes de latence en mémoire fixe, exposés au format
+    texte Prometheus.
 
-def get_relay_state():
+    Une série par (type, nom) : "route" pour les routes Flask, "upstream"
+    pour les appels au Pico. Chaque série garde le nombre d'appels, la somme
+    des latences, le nombre d'erreurs et un compteur par tranche de latence.
+    """
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    def __init__(self, prefix="gateway"):
+        self.prefix = prefix
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, elapsed_ms, error=False):
+        with self._lock:
+            series = self.series.get((kind, name))
+            if series is None:
+                series = self.series[(kind, name)] = {
+                    "count": 0, "sum": 0.0, "errors": 0,
+                    "buckets": [0] * (len(self.BUCKETS_MS) + 1),
+                }
+            series["count"] += 1
+            series["sum"] += elapsed_ms
+            if error:
+                series["errors"] += 1
+            for i, bound in enumerate(self.BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    series["buckets"][i] += 1
+                    break
+            else:
+                series["buckets"][-1] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for kind in ("route", "upstream"):
+                family = f"{self.prefix}_{kind}_latency_ms"
+                lines.append(f"# TYPE {family} histogram")
+                for (series_kind, name), series in sorted(self.series.items()):
+                    if series_kind != kind:
+                        continue
+                    labels = f'{kind}="{name}"'
+                    cumulative = 0
+                    for i, bound in enumerate(self.BUCKETS_MS):
+                        cumulative += series["buckets"][i]
+                        lines.append(f'{family}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{family}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                    lines.append(f'{family}_sum{{{labels}}} {series["sum"]:.3f}')
+                    lines.append(f'{family}_count{{{labels}}} {series["count"]}')
+                errors = f"{self.prefix}_{kind}_errors_total"
+                lines.append(f"# TYPE {errors} counter")
+                for (series_kind, name), series in sorted(self.series.items()):
+                    if series_kind == kind:
+                        lines.append(f'{errors}{{{kind}="{name}"}} {series["errors"]}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def label_board_metrics(families, text, board=None):
     """
-    Retourne la page html info.html
+    Range les lignes d'une exposition Prometheus par famille dans `families`
+    (nom -> lignes, TYPE en tête), en ajoutant le label board="<nom>" aux
+    échantillons d'un Pico : les échantillons de toutes les cartes d'une
+    famille restent contigus, sous un seul TYPE
     """
-    url = URL_PICO + "/relays"
-    try:
-        response = requests.get(url,timeout=3)
-        relays = response.json()
-        print(relays)
-        return (relays)
-    except requests.exceptions.ConnectionError:
-        return (" ...no relay states")
-    
+    family = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            family = line.split()[2]
+            families.setdefault(family, [line])
+            continue
+        if not line or line.startswith("#"):
+            continue
+        if board is not None:
+            if "{" in line:
+                line = line.replace("{", f'{{board="{board}",', 1)
+            else:
+                name, value = line.split(" ", 1)
+                line = f'{name}{{board="{board}"}} {value}'
+        name = line.split("{", 1)[0]
+        if family is None or not name.startswith(family):
+            # échantillon sans TYPE : famille à son nom
+            family = name
+            families.setdefault(family, [])
+        families[family].append(line)
+    return families
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    if request.url_rule is not None and "started" in g:
+        elapsed_ms = (time.perf_counter() - g.started) * 1000
+        name = f"{request.method} {request.url_rule.rule}"
+        metrics.observe("route", name, elapsed_ms, response.status_code >= 500)
+    return response
+
+
+###### Pico upstream client  ########
+
+
+class PicoUnavailable(requests.exceptions.ConnectionError):
+    """
+    Levée sans appel réseau tant que le disjoncteur d'une carte est ouvert
+    """
+
+
+class PicoHealth(object):
+    """
+    Suivi de l'accessibilité d'un Pico et disjoncteur (circuit breaker).
+
+    Fermé : les requêtes passent, avec un timeout déduit de la latence
+    observée (moyenne lissée + 4 écarts, comme TCP), borné entre
+    min_timeout et max_timeout. Après `threshold` échecs consécutifs le
+    disjoncteur s'ouvre : les requêtes échouent immédiatement au lieu
+    d'attendre le timeout. Passé un délai (doublé à chaque essai manqué,
+    borné à max_cooldown), une seule requête d'essai est autorisée
+    (semi-ouvert) et son succès referme le disjoncteur. Un thread de
+    surveillance sonde la carte lorsqu'elle n'est pas sollicitée : pannes
+    et rétablissements sont détectés sans qu'une page ait à attendre.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, probe, max_timeout=3, min_timeout=1, threshold=3,
+                 cooldown=2, max_cooldown=30, interval=5):
+        """
+        :param probe: fonction appelant le Pico (requête de surveillance)
+        """
+        self.probe = probe
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.interval = interval
+        self.state = self.CLOSED
+        self.failures = 0            # échecs consécutifs
+        self.cooldown = cooldown
+        self.retry_at = 0.0          # fin du délai en état ouvert
+        self.last_seen = None        # dernière réponse du Pico
+        self.srtt = None             # latence lissée (s)
+        self.rttvar = None           # écart moyen de la latence (s)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def connected(self):
+        """
+        Vrai si la dernière requête vers le Pico a abouti
+        """
+        return self.state == self.CLOSED and self.failures == 0 and self.last_seen is not None
+
+    @property
+    def timeout(self):
+        """
+        Timeout adaptatif, en secondes
+        """
+        if self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+    def acquire(self):
+        """
+        Autorise une requête : retourne le timeout à utiliser, ou lève
+        PicoUnavailable si le disjoncteur est ouvert
+        """
+        self.start()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return self.timeout
+            if self.state == self.OPEN and time.monotonic() >= self.retry_at:
+                # requête d'essai : le Pico a droit au timeout complet
+                self.state = self.HALF_OPEN
+                return self.max_timeout
+            if self.state == self.OPEN:
+                raise PicoUnavailable(f"Pico indisponible, nouvel essai dans {self.retry_at - time.monotonic():.0f} s")
+            raise PicoUnavailable("Pico indisponible, essai en cours")
+
+    def record(self, ok, elapsed=None):
+        """
+        Enregistre le résultat d'une requête (ok : le Pico a répondu)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if ok:
+                self.last_seen = now
+                self.failures = 0
+                if self.srtt is None:
+                    self.srtt, self.rttvar = elapsed, elapsed / 2
+                else:
+                    self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - elapsed)
+                    self.srtt = 0.875 * self.srtt + 0.125 * elapsed
+                if self.state != self.CLOSED:
+                    print("Pico rétabli")
+                    self.state = self.CLOSED
+                    self.cooldown = self.base_cooldown
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.state == self.CLOSED and self.failures < self.threshold:
+                return
+            if self.state == self.CLOSED:
+                print(f"Pico injoignable ({self.failures} échecs), disjoncteur ouvert")
+            self.state = self.OPEN
+            self.retry_at = now + self.cooldown
+
+    def start(self):
+        """
+        Démarre le thread de surveillance (au premier appel vers le Pico)
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True)
+                    self._thread.start()
+
+    def run(self):
+        """
+        Sonde le Pico s'il n'a pas répondu depuis `interval` secondes, ou
+        dès la fin du délai quand le disjoncteur est ouvert
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.state == self.OPEN:
+                    delay = self.retry_at - now
+                elif self.last_seen is not None:
+                    delay = self.last_seen + self.interval - now
+                else:
+                    delay = 0
+            if delay > 0:
+                time.sleep(min(delay, self.interval))
+                continue
+            try:
+                self.probe()
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(1)
+
+
+class PicoClient(object):
+    """
+    Client HTTP partagé par toutes les routes vers le Pico.
+
+    Les connexions sont gérées par une session requests (pool keep-alive,
+    nombre de connexions simultanées limité pour ne pas saturer le serveur
+    Microdot mono-tâche du Pico). Les GET identiques lancés en même temps
+    sont regroupés : un seul appel part vers le Pico et tous les appelants
+    reçoivent le même résultat (single-flight). L'état de la carte est suivi
+    par un PicoHealth : timeout adaptatif et échec immédiat quand elle est
+    injoignable.
+    """
+
+    def __init__(self, base_url, timeout=3, pool_size=2, cache_size=32):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.health = PicoHealth(lambda: self.get("/relays"), max_timeout=timeout)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()   # chemin -> dernière réponse portant un ETag
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              pool_block=True, max_retries=0)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _request(self, method, path, payload=None, headers=None):
+        timeout = self.health.acquire()
+        started = time.perf_counter()
+        error = True
+        try:
+            try:
+                response = self.session.request(method, self.base_url + path, json=payload,
+                                                headers=headers, timeout=timeout)
+            except requests.exceptions.RequestException:
+                self.health.record(False)
+                raise
+            self.health.record(True, time.perf_counter() - started)
+            response.raise_for_status()
+            error = False
+            return response
+        finally:
+            # chemin sans paramètres ni identifiants, pour borner le nombre de séries
+            name = method + " " + re.sub(r"/\d+", "/<n>", path.split("?")[0])
+            metrics.observe("upstream", name, (time.perf_counter() - started) * 1000, error)
+
+    def get(self, path):
+        """
+        GET coalescé : retourne la réponse du Pico ou lève une RequestException
+        """
+        with self._lock:
+            future = self._inflight.get(path)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[path] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._conditional_get(path))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[path]
+        return future.result()
+
+    def _conditional_get(self, path):
+        """
+        GET avec If-None-Match : un 304 du Pico réutilise la dernière réponse
+        """
+        with self._lock:
+            cached = self._cache.get(path)
+        headers = None
+        if cached is not None:
+            headers = {"If-None-Match": cached.headers["ETag"]}
+        response = self._request("GET", path, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached
+        if "ETag" in response.headers:
+            with self._lock:
+                self._cache[path] = response
+                self._cache.move_to_end(path)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return response
+
+    def fetch(self, path, default):
+        """
+        Retourne (données, connecté) : la sonde de connexion est l'appel lui-même
+        """
+        try:
+            return self.get(path).json(), True
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Pico {path} : {e}")
+            return default, False
+
+    def command(self, path, payload=None, method="POST"):
+        """
+        Envoie une commande au Pico (jamais regroupée avec une autre)
+        """
+        return self._request(method, path, payload).json()
+
+
+class PicoSocket(object):
+    """
+    Canal de commande WebSocket persistant vers un Pico, partagé par tous
+    les navigateurs.
+
+    Une seule connexion est ouverte par carte (le Pico n'en accepte que
+    deux) : une commande de relais coûte alors un aller-retour WiFi, sans
+    établissement de connexion. Les commandes portent un identifiant
+    renvoyé dans leur acquittement, ce qui permet d'en avoir plusieurs en
+    vol en même temps (pipelining). Un thread lit la connexion : il remet
+    chaque acquittement à la commande qui l'attend et transmet les
+    changements d'état poussés par le Pico à `on_push`. Sans trafic
+    pendant `heartbeat` secondes, l'état est demandé ; sans réponse au
+    délai suivant, la connexion est considérée comme morte. La connexion
+    n'est tentée que si le disjoncteur de la carte est fermé.
+    """
+
+    def __init__(self, base_url, health, on_push, timeout=3, heartbeat=15, max_delay=30):
+        """
+        :param health: PicoHealth de la carte (timeout adaptatif, disjoncteur)
+        :param on_push: fonction appelée avec l'état des relais poussé par le Pico
+        """
+        self.url = "ws" + base_url[len("http"):] + "/ws"
+        self.health = health
+        self.on_push = on_push
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.max_delay = max_delay
+        self._ws = None
+        self._next_id = 0
+        self._pending = {}           # identifiant -> Future de l'acquittement
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def connected(self):
+        return self._ws is not None
+
+    def start(self):
+        """
+        Démarre le thread de connexion et de lecture (idempotent)
+        """
+        if websocket is None:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True)
+                    self._thread.start()
+
+    def request(self, command):
+        """
+        Envoie une commande et attend son acquittement.
+        Retourne l'acquittement ({"id", "ok", "relays"}) ; lève PicoUnavailable
+        si le canal est fermé ou ne répond pas, ValueError si le Pico refuse
+        la commande
+        """
+        started = time.perf_counter()
+        error = True
+        try:
+            with self._lock:
+                ws = self._ws
+                if ws is None:
+                    raise PicoUnavailable("Canal WebSocket fermé")
+                self._next_id += 1
+                command_id = self._next_id
+                future = self._pending[command_id] = Future()
+            try:
+                ws.send(json.dumps(dict(command, id=command_id)))
+                ack = future.result(timeout=self.health.timeout)
+            except FutureTimeoutError:
+                # connexion probablement coupée : le thread de lecture la rouvrira
+                ws.abort()
+                raise PicoUnavailable("Acquittement non reçu")
+            except (websocket.WebSocketException, OSError) as e:
+                ws.abort()
+                raise PicoUnavailable(f"Canal WebSocket : {e}")
+            finally:
+                with self._lock:
+                    self._pending.pop(command_id, None)
+            self.health.record(True, time.perf_counter() - started)
+            if not ack.get("ok"):
+                raise ValueError(ack.get("error", "Commande refusée"))
+            error = False
+            return ack
+        finally:
+            metrics.observe("upstream", "WS " + str(command.get("cmd")),
+                            (time.perf_counter() - started) * 1000, error)
+
+    def run(self):
+        delay = 1
+        while True:
+            if self.health.state != PicoHealth.CLOSED:
+                time.sleep(1)
+                continue
+            try:
+                ws = websocket.create_connection(self.url, timeout=self.timeout, enable_multithread=True)
+            except (websocket.WebSocketException, OSError) as e:
+                print(f"Canal WebSocket {self.url} : {e}")
+            else:
+                ws.settimeout(self.heartbeat)
+                with self._lock:
+                    self._ws = ws
+                if self._read(ws):
+                    delay = 1
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def _read(self, ws):
+        """
+        Lit la connexion jusqu'à sa fermeture.
+        Retourne vrai si le Pico a répondu au moins une fois
+        """
+        answered = silent = False
+        try:
+            while True:
+                try:
+                    message = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    if silent:
+                        raise PicoUnavailable("aucune réponse")
+                    silent = True
+                    ws.send(json.dumps({"id": 0, "cmd": "state"}))
+                    continue
+                if not message:
+                    break
+                answered, silent = True, False
+                data = json.loads(message)
+                if "event" in data or data.get("id") == 0:
+                    self.on_push(data["relays"])
+                    continue
+                with self._lock:
+                    future = self._pending.get(data.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except (websocket.WebSocketException, OSError, ValueError, KeyError) as e:
+            print(f"Canal WebSocket {self.url} : {e}")
+        finally:
+            with self._lock:
+                self._ws = None
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(PicoUnavailable("Canal WebSocket fermé"))
+            try:
+                ws.close(timeout=1)
+            except (websocket.WebSocketException, OSError):
+                pass
+        return answered
+
+
+class EventFeed(object):
+    """
+    Copie locale du journal d'événements du Pico, alimentée par deltas.
+
+    Chaque événement porte un numéro de séquence croissant ; seuls les
+    événements postérieurs au dernier numéro connu sont demandés
+    (/events?since=<seq>&limit=<n>). La copie locale peut ainsi conserver
+    plus d'événements que le tampon du Pico.
+    """
+
+    def __init__(self, client, max_events=500, batch_size=50, on_events=None):
+        """
+        :param on_events: fonction appelée avec chaque lot de nouveaux événements
+        """
+        self.client = client
+        self.batch_size = batch_size
+        self.on_events = on_events
+        self.events = deque(maxlen=max_events)   # du plus récent au plus ancien
+        self.last_seq = 0
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """
+        Récupère les nouveaux événements : retourne (liste, connecté)
+        """
+        with self._lock:
+            try:
+                while True:
+                    response = self.client.get(f"/events?since={self.last_seq}&limit={self.batch_size}")
+                    events = response.json()
+                    device_seq = int(response.headers.get("X-Event-Seq", 0))
+                    if device_seq < self.last_seq:
+                        # journal du Pico réinitialisé : on repart de zéro
+                        self.events.clear()
+                        self.last_seq = 0
+                        continue
+                    if events:
+                        self.events.extendleft(reversed(events))
+                        self.last_seq = events[0]["seq"]
+                        if self.on_events:
+                            self.on_events(events)
+                    if len(events) < self.batch_size or self.last_seq >= device_seq:
+                        break
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f"Pico /events : {e}")
+                return None, False
+            return list(self.events), True
+
+
+class PicoMirror(object):
+    """
+    Copie locale de l'état du Pico (relais, système, événements).
+
+    Les pages sont rendues immédiatement depuis la copie ; lorsqu'une ressource
+    dépasse sa durée de vie (TTL), elle est rafraîchie en arrière-plan
+    (stale-while-revalidate). Seul le tout premier accès attend le Pico.
+    """
+
+    def __init__(self, client, resources):
+        """
+        :param client: PicoClient utilisé pour les rafraîchissements
+        :param resources: dict nom -> (source, valeur par défaut, TTL en secondes) ;
+                          la source est un chemin sur le Pico ou une fonction
+                          retournant (données, connecté)
+        """
+        self.client = client
+        self.resources = resources
+        self._lock = threading.Lock()
+        self._entries = {}
+        for name, (path, default, ttl) in resources.items():
+            self._entries[name] = {
+                "data": default,
+                "updated": None,     # dernier rafraîchissement réussi
+                "checked": None,     # dernière tentative
+                "connected": False,
+                "refreshing": False,
+                "generation": 0,     # incrémenté à chaque invalidation
+                "version": 0,        # incrémenté à chaque changement des données
+            }
+
+    def get(self, name):
+        """
+        Retourne (données, âge en secondes ou None, connecté)
+        """
+        entry = self._entries[name]
+        ttl = self.resources[name][2]
+        if entry["checked"] is None:
+            self.refresh(name)
+        elif time.monotonic() - entry["checked"] > ttl:
+            self.refresh_async(name)
+        return self.snapshot(name)
+
+    def snapshot(self, name):
+        """
+        Retourne (données, âge, connecté) sans déclencher de rafraîchissement
+        """
+        entry = self._entries[name]
+        with self._lock:
+            age = None
+            if entry["updated"] is not None:
+                age = int(time.monotonic() - entry["updated"])
+            return entry["data"], age, self.client.health.connected
+
+    def version(self, name):
+        """
+        Numéro de version des données d'une ressource (clé de cache des pages)
+        """
+        return self._entries[name]["version"]
+
+    def refresh(self, name):
+        """
+        Rafraîchit une ressource depuis le Pico (bloquant)
+        """
+        path, default, ttl = self.resources[name]
+        entry = self._entries[name]
+        with self._lock:
+            generation = entry["generation"]
+        if callable(path):
+            data, connected = path()
+        else:
+            data, connected = self.client.fetch(path, None)
+        now = time.monotonic()
+        with self._lock:
+            entry["checked"] = now
+            entry["connected"] = connected
+            if connected:
+                if data != entry["data"]:
+                    entry["version"] += 1
+                entry["data"] = data
+                entry["updated"] = now
+            entry["refreshing"] = False
+            invalidated = entry["generation"] != generation
+        if invalidated:
+            # une commande est passée pendant l'appel : la réponse est peut-être déjà périmée
+            self.refresh_async(name)
+
+    def refresh_async(self, name):
+        """
+        Lance un rafraîchissement en arrière-plan s'il n'y en a pas déjà un
+        """
+        with self._lock:
+            entry = self._entries[name]
+            if entry["refreshing"]:
+                return
+            entry["refreshing"] = True
+        threading.Thread(target=self.refresh, args=(name,), daemon=True).start()
+
+    def update(self, name, data):
+        """
+        Remplace les données d'une ressource par un état reçu du Pico
+        (acquittement ou changement poussé) ; retourne vrai si elles ont changé
+        """
+        entry = self._entries[name]
+        now = time.monotonic()
+        with self._lock:
+            # un rafraîchissement HTTP en cours ne doit pas écraser cet état
+            entry["generation"] += 1
+            changed = data != entry["data"]
+            if changed:
+                entry["version"] += 1
+            entry["data"] = data
+            entry["updated"] = entry["checked"] = now
+            entry["connected"] = True
+        return changed
+
+    def invalidate(self, *names):
+        """
+        Marque des ressources comme périmées et relance leur rafraîchissement
+        """
+        for name in names:
+            with self._lock:
+                self._entries[name]["generation"] += 1
+            self.refresh_async(name)
+
+
+class StreamBroker(object):
+    """
+    Diffusion Server-Sent Events des changements du Pico.
+
+    Un seul poller interroge le Pico (via la copie locale), calcule les
+    différences sur l'état des relais et les nouveaux événements, et pousse
+    uniquement ces deltas à tous les navigateurs abonnés. La charge sur le
+    Pico ne dépend donc pas du nombre d'onglets ouverts.
+    """
+
+    def __init__(self, mirror, interval=2, queue_size=100):
+        self.mirror = mirror
+        self.interval = interval
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._relays = None
+        self._last_seq = None
+        self._connected = None
+
+    def subscribe(self):
+        """
+        Enregistre un abonné (avant la lecture de son instantané, pour ne
+        manquer aucune différence publiée entre-temps)
+        """
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def start(self, relays, connected):
+        """
+        Démarre le poller si nécessaire. L'état déjà vu part de l'instantané
+        envoyé à l'abonné : le premier sondage ne republie pas les relais et
+        la connexion qu'il vient de recevoir, ni les événements déjà affichés
+        par la page
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._connected = connected
+            self._relays = dict(relays) if connected and isinstance(relays, dict) else None
+            self._last_seq = None
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def wake(self):
+        """
+        Demande un sondage immédiat (après une commande de relais par exemple)
+        """
+        self._wakeup.set()
+
+    def publish(self, kind, data):
+        message = f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # navigateur trop lent : il sera resynchronisé à sa reconnexion
+                self.unsubscribe(subscriber)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Erreur stream : {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def poll(self):
+        """
+        Rafraîchit relais et événements puis publie les différences
+        """
+        self.mirror.refresh("relays")
+        self.mirror.refresh("events")
+        relays, age, connected = self.mirror.snapshot("relays")
+        events, age, events_connected = self.mirror.snapshot("events")
+
+        if connected != self._connected:
+            self._connected = connected
+            self.publish("status", {"connected": connected})
+
+        if connected and isinstance(relays, dict):
+            previous = self._relays or {}
+            changes = {k: v for k, v in relays.items() if previous.get(k) != v}
+            self._relays = dict(relays)
+            if changes:
+                self.publish("relays", changes)
+
+        if events_connected and events:
+            if self._last_seq is not None and events[0]["seq"] >= self._last_seq:
+                new_events = [event for event in events if event["seq"] > self._last_seq]
+                if new_events:
+                    self.publish("events", new_events)
+            # au premier sondage, les pages contiennent déjà ces événements
+            self._last_seq = events[0]["seq"]
+
+    def stream(self):
+        """
+        Générateur SSE pour un navigateur
+        """
+        subscriber = self.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            relays, age, connected = self.mirror.get("relays")
+            self.start(relays, connected)
+            yield f"event: status\ndata: {json.dumps({'connected': connected})}\n\n"
+            if isinstance(relays, dict):
+                yield f"event: relays\ndata: {json.dumps(relays)}\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+# Nombre d'événements par page dans events.html
+EVENTS_PAGE_SIZE = 20
+
+# Durée de vie (secondes) de chaque ressource dans la copie locale
+MIRROR_TTL = {"relays": 2, "system": 10, "events": 5}
+
+# Historique SQLite des événements et mesures de toutes les cartes
+HISTORY_DB = os.environ.get("PICO_HISTORY_DB", os.path.join(app.root_path, "history.db"))
+history = HistoryStore(HISTORY_DB)
+
+
+class Board(object):
+    """
+    Une carte relais Pico et les composants qui lui sont propres :
+    client HTTP, canal de commande WebSocket, copie locale et flux SSE
+    """
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.client = PicoClient(url)
+        self.feed = EventFeed(self.client, on_events=lambda events: history.add_events(name, events))
+        self.mirror = PicoMirror(self.client, {
+            "relays": ("/relays", default_relays, MIRROR_TTL["relays"]),
+            "system": ("/system", default_system, MIRROR_TTL["system"]),
+            "events": (self.feed.fetch, [], MIRROR_TTL["events"]),
+        })
+        self.broker = StreamBroker(self.mirror)
+        self.socket = PicoSocket(url, self.client.health, on_push=self.on_push)
+
+    def on_push(self, relays):
+        """
+        État des relais poussé par le Pico (commande d'un autre client,
+        planification...) : mise à jour de la copie et du flux SSE
+        """
+        if self.mirror.update("relays", relays):
+            self.mirror.invalidate("events")
+            self.broker.wake()
+
+    def command(self, changes):
+        """
+        Commande groupée de relais : par le canal WebSocket s'il est ouvert,
+        sinon par POST /relays. Les commandes portent des états absolus, la
+        rejouer en HTTP après un acquittement perdu est donc sans risque.
+        :param changes: {"1": 1, ...} ou {"mask": <bits>, "values": <bits>}
+        :return: état des relais retourné par le Pico
+        """
+        if isinstance(changes, dict) and self.socket.connected:
+            try:
+                ack = self.socket.request({"cmd": "relays", "changes": changes})
+            except PicoUnavailable as e:
+                print(f"Canal WebSocket {self.name} : {e}, repli HTTP")
+            else:
+                self.mirror.update("relays", ack["relays"])
+                self.mirror.invalidate("events")
+                self.broker.wake()
+                return ack["relays"]
+        try:
+            return self.client.command("/relays", changes)
+        finally:
+            self.mirror.invalidate("relays", "events")
+            self.broker.wake()
+
+
+class Fleet(object):
+    """
+    Registre des cartes relais.
+
+    Les opérations sur toute la flotte sont lancées en parallèle dans un pool
+    de threads borné : une vue d'ensemble coûte à peu près la latence d'une
+    seule carte, et chaque carte a son propre timeout et son propre résultat.
+    """
+
+    def __init__(self, boards, max_workers=8, timeout=3):
+        self.boards = {name: Board(name, url) for name, url in boards.items()}
+        self.default = next(iter(self.boards))
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fleet")
+
+    def get(self, name):
+        return self.boards.get(name)
+
+    def map(self, func, timeout=None):
+        """
+        Applique func(board) à toutes les cartes en parallèle.
+        Retourne dict nom -> {"ok", "result" ou "error", "elapsed_ms"}
+        """
+        timeout = timeout or self.timeout
+        started = time.monotonic()
+        futures = {name: self.executor.submit(func, board) for name, board in self.boards.items()}
+        results = {}
+        for name, future in futures.items():
+            remaining = max(0, started + timeout - time.monotonic())
+            try:
+                result = {"ok": True, "result": future.result(timeout=remaining)}
+            except FutureTimeoutError:
+                result = {"ok": False, "error": "timeout"}
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            result["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+            results[name] = result
+        return results
+
+
+fleet = Fleet(BOARDS)
+
+
+class HistoryHarvester(object):
+    """
+    Récolte en continu les événements et les mesures de toutes les cartes
+    dans l'historique.
+
+    Toutes les `interval` secondes, les nouveaux événements de chaque carte
+    sont demandés (par deltas, via l'EventFeed de la carte) ; les mesures
+    agrégées à la minute le sont toutes les `samples_interval` secondes.
+    Les lignes récoltées sont écrites en une transaction par cycle, et la
+    rétention de l'historique est appliquée toutes les `maintain_interval`
+    secondes.
+    """
+
+    def __init__(self, store, interval=30, samples_interval=600, maintain_interval=3600, resolution=60):
+        self.store = store
+        self.interval = interval
+        self.samples_interval = samples_interval
+        self.maintain_interval = maintain_interval
+        self.resolution = resolution
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Démarre le thread de récolte (idempotent)
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True)
+                    self._thread.start()
+
+    def harvest(self, board, samples):
+        """
+        Récolte une carte : nouveaux événements et, si demandé, mesures
+        """
+        board.feed.fetch()
+        if samples:
+            data, connected = board.client.fetch(f"/system/history?resolution={self.resolution}", None)
+            if connected and data:
+                self.store.add_samples(board.name, data, self.resolution)
+
+    def run(self):
+        last_samples = last_maintain = 0
+        while True:
+            now = time.monotonic()
+            samples = now - last_samples >= self.samples_interval
+            fleet.map(lambda board: self.harvest(board, samples), timeout=self.interval)
+            if samples:
+                last_samples = now
+            try:
+                self.store.flush()
+                if now - last_maintain >= self.maintain_interval:
+                    self.store.maintain()
+                    last_maintain = now
+            except Exception as e:
+                print(f"Erreur historique : {e}")
+            time.sleep(self.interval)
+
+
+harvester = HistoryHarvester(history)
+
+
+def start_background():
+    """
+    Démarre la récolte de l'historique et les WebSockets des cartes
+    (idempotent : à rappeler si `fleet` est remplacée)
+    """
+    harvester.start()
+    for board in fleet.boards.values():
+        board.socket.start()
+
+
+start_background()
+
+
+def current_board():
+    """
+    Carte sélectionnée : paramètre ?board=, sinon celle de la session,
+    sinon la carte par défaut
+    """
+    name = request.args.get("board")
+    if name in fleet.boards:
+        session["board"] = name
+    else:
+        name = session.get("board")
+        if name not in fleet.boards:
+            name = fleet.default
+    return fleet.boards[name]
+
+
+@app.context_processor
+def inject_boards():
+    """
+    Rend la liste des cartes et la carte courante disponibles dans les templates
+    """
+    return {"boards": list(fleet.boards), "board": current_board().name}
+
+
+class PageCache(object):
+    """
+    Pages HTML rendues, mises en cache par version des données.
+
+    La clé contient tout ce dont dépend le rendu (template, carte, version
+    des données, état de connexion...) et l'ETag de la page en est dérivé :
+    tant que l'état du Pico ne change pas, la page n'est ni re-rendue ni
+    renvoyée (304).
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, key, template, **context):
+        """
+        Retourne (html, etag) pour la clé, en ne rendant le template qu'en cas d'absence
+        """
+        with self._lock:
+            html = self._pages.get(key)
+            if html is not None:
+                self._pages.move_to_end(key)
+        if html is None:
+            html = render_template(template, **context)
+            with self._lock:
+                self._pages[key] = html
+                while len(self._pages) > self.max_entries:
+                    self._pages.popitem(last=False)
+        return html, hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+
+
+page_cache = PageCache()
+
+# Marqueur remplacé à chaque réponse par l'horodatage des données (hors cache)
+DATA_UPDATED_MARK = "__DATA_UPDATED__"
+
+
+def cached_page(key, template, age, **context):
+    """
+    Rend une page via le cache, avec ETag (faible : seul l'horodatage des
+    données varie entre deux réponses de même ETag) et réponse 304
+    """
+    key = (template, current_board().name, tuple(fleet.boards), age is None) + key
+    data_updated = None if age is None else DATA_UPDATED_MARK
+    html, etag = page_cache.render(key, template, data_updated=data_updated, **context)
+    if age is not None:
+        html = html.replace(DATA_UPDATED_MARK, str(int(time.time()) - age))
+    response = make_response(html)
+    response.set_etag(etag, weak=True)
+    return response.make_conditional(request)
+
+
+# Fichiers statiques compressés : chemin -> (etag, contenu gzip)
+gzip_cache = {}
+GZIP_TYPES = ("text/css", "text/javascript", "application/javascript", "application/json",
+              "application/manifest+json", "image/svg+xml", "text/plain")
+
+
+@app.after_request
+def compress_static(response):
+    """
+    Sert les fichiers statiques compressés (gzip) aux navigateurs qui l'acceptent
+    """
+    if (request.endpoint not in ("static", "serviceworker", "manifest")
+            or response.status_code != 200
+            or response.mimetype not in GZIP_TYPES
+            or "gzip" not in request.headers.get("Accept-Encoding", "")):
+        return response
+
+    etag = response.get_etag()[0]
+    cached = gzip_cache.get(request.path)
+    response.direct_passthrough = False
+    if cached is None or cached[0] != etag:
+        cached = gzip_cache[request.path] = (etag, gzip.compress(response.get_data(), 9))
+    response.close()
+    response.set_data(cached[1])
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
 ###### routes  ########
 
 
@@ -76,12 +1259,10 @@ def home():
     """
     Retourne la page html principale 
     """
-    if is_connected():
-        relays = get_relay_state()
-        return render_template("relais.html", relays=relays, connected=True)
-    else:
-        relays=default_relays
-        return render_template("relais.html", relays=relays, connected=False)
+    mirror = current_board().mirror
+    relays, age, connected = mirror.get("relays")
+    return cached_page((mirror.version("relays"), connected), "relais.html", age,
+                       relays=relays, connected=connected)
 
 
 @app.route("/relais", methods=["GET","POST"])
@@ -89,28 +1270,32 @@ def relais():
     """
     Retourne la page relais.html
     """
-    url = URL_PICO + "/relays"
-    try:
-        response = requests.get(url,timeout=3)
-        relays = response.json()
-        return render_template("relais.html", relays=relays, connected=True)
-    except: 
-        relays=default_relays
-        return render_template("relais.html", relays=relays, connected=False)
+    mirror = current_board().mirror
+    relays, age, connected = mirror.get("relays")
+    return cached_page((mirror.version("relays"), connected), "relais.html", age,
+                       relays=relays, connected=connected)
 
 @app.route("/system", methods=["GET","POST"])
 def system():
     """
     Retourne la page system.html
     """
-    url = URL_PICO + "/system"
-    try:
-        response = requests.get(url,timeout=3)
-        system = response.json()
-        return render_template("system.html", system=system, connected=True)
-    except :
-        return render_template("system.html", system=default_system,connected=False)
+    mirror = current_board().mirror
+    system, age, connected = mirror.get("system")
+    return cached_page((mirror.version("system"), connected), "system.html", age,
+                       system=system, connected=connected)
     
+@app.route("/system/history", methods=["GET"])
+def system_history():
+    """
+    Retourne l'historique agrégé (min/moy/max) des mesures du Pico en JSON
+    """
+    resolution = request.args.get("resolution", 60, type=int)
+    data, connected = current_board().client.fetch(f"/system/history?resolution={resolution}", None)
+    if not connected:
+        return jsonify({"error": "Pico non joignable"}), 502
+    return jsonify(data)
+
 @app.route("/parameters", methods=["GET","POST"])
 def parameters():
     """
@@ -120,50 +1305,275 @@ def parameters():
     return render_template("parameters.html", connected=True)
 
 
+def schedule_command(path, payload=None, method="GET"):
+    """
+    Transmet une requête de planification à la carte courante ; les erreurs
+    de validation du Pico (400, 404) sont renvoyées telles quelles
+    """
+    board = current_board()
+    try:
+        result = board.client.command(path, payload, method)
+    except requests.exceptions.HTTPError as e:
+        try:
+            return jsonify(e.response.json()), e.response.status_code
+        except ValueError:
+            return jsonify({"error": str(e)}), 502
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Erreur planification {board.name} {path} : {e}")
+        return jsonify({"error": str(e)}), 502
+    if method != "GET":
+        board.mirror.invalidate("events")
+    return jsonify(result)
+
+
+@app.route("/schedule", methods=["GET"])
+def schedule():
+    """
+    Retourne les tâches planifiées du Pico
+    """
+    return schedule_command("/schedule")
+
+
+@app.route("/schedule", methods=["POST"])
+def schedule_add():
+    """
+    Crée une tâche planifiée sur le Pico
+    """
+    return schedule_command("/schedule", request.get_json(silent=True), "POST")
+
+
+@app.route("/schedule/<int:job_id>", methods=["PUT", "DELETE"])
+def schedule_job(job_id):
+    """
+    Modifie ou supprime une tâche planifiée du Pico
+    """
+    return schedule_command(f"/schedule/{job_id}", request.get_json(silent=True), request.method)
+
+
 @app.route("/events", methods=["GET","POST"])
 def events():
     """
     Retourne la page html events.html
     """
-    
-    url = URL_PICO + "/events"
+    board = current_board()
+    # la copie locale amène les derniers événements du Pico dans l'historique
+    _, age, connected = board.mirror.get("events")
+    history.flush()
+    page = max(request.args.get("page", 1, type=int), 1)
+    level = request.args.get("level") or None
+    relay = request.args.get("relay", type=int)
+    rows = history.events(board.name, level=level, relay=relay,
+                          limit=EVENTS_PAGE_SIZE + 1, offset=(page - 1) * EVENTS_PAGE_SIZE)
+    return cached_page((history.versions.get(board.name, 0), connected, page, level, relay),
+                       "events.html", age, events=rows[:EVENTS_PAGE_SIZE], page=page,
+                       has_next=len(rows) > EVENTS_PAGE_SIZE, level=level, relay=relay,
+                       connected=connected)
+
+
+def history_range(default_days):
+    """
+    Intervalle [start, end[ des paramètres start/end (epoch ou date ISO, UTC)
+    """
+    end = parse_time(request.args.get("end"), int(time.time()) + 1)
+    start = parse_time(request.args.get("start"), end - default_days * 86400)
+    return start, end
+
+
+@app.route("/history/events", methods=["GET"])
+def history_events():
+    """
+    Événements de l'historique : ?start=&end=&level=&relay=&limit=&offset=
+    """
+    try:
+        start, end = history_range(365)
+        history.flush()
+        rows = history.events(current_board().name, start, end,
+                              level=request.args.get("level") or None,
+                              relay=request.args.get("relay", type=int),
+                              limit=min(max(request.args.get("limit", 100, type=int), 1), 1000),
+                              offset=max(request.args.get("offset", 0, type=int), 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"start": start, "end": end, "events": rows})
+
+
+@app.route("/history/relays", methods=["GET"])
+def history_relays():
+    """
+    Par relai, nombre de commutations et durée d'activation (s) : ?start=&end=
+    (30 derniers jours par défaut)
+    """
+    try:
+        start, end = history_range(30)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    history.flush()
+    return jsonify({"start": start, "end": end, "relays": history.relay_stats(current_board().name, start, end)})
+
+
+@app.route("/history/system", methods=["GET"])
+def history_system():
+    """
+    Mesures de l'historique : ?metric=temperature&start=&end=&resolution=60|3600
+    (24 dernières heures par défaut)
+    """
+    metric = request.args.get("metric", "temperature")
     try:
-        response = requests.get(url, timeout=3)
-        response.raise_for_status()
-        events_data = response.json()
-        return render_template("events.html", events=events_data, connected=True)
-    except: 
-        return render_template("events.html", events=[], connected=False)
+        start, end = history_range(1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    history.flush()
+    result = history.samples(current_board().name, metric, start, end,
+                             request.args.get("resolution", type=int))
+    result.update({"metric": metric, "start": start, "end": end})
+    return jsonify(result)
     
 @app.route("/get_relay_state", methods=["GET","POST"])
 def get_relay_state():
     """
-    Retourne la page html info.html
+    Retourne l'état des relais en JSON
+    """
+    relays, age, connected = current_board().mirror.get("relays")
+    if age is None:
+        return (" ...no relay states")
+    return jsonify(relays)
+
+
+def relay_command(changes):
+    """
+    Transmet une commande groupée à la carte courante (canal WebSocket,
+    sinon HTTP) ; retourne l'état des relais, ou l'erreur 400 du Pico si la
+    commande est invalide. Sa copie locale et son flux SSE sont mis à jour
     """
-    url = URL_PICO + "/relays"
+    board = current_board()
     try:
-        response = requests.get(url,timeout=3)
-        relays = response.json()
-        return jsonify(relays)
-    except requests.exceptions.ConnectionError:
-        return (" ...no relay states") 
+        result = board.command(changes)
+    except requests.exceptions.HTTPError as e:
+        # commande refusée par le Pico (relai ou état invalide) : renvoyée telle quelle
+        if 400 <= e.response.status_code < 500:
+            try:
+                return jsonify(e.response.json()), e.response.status_code
+            except ValueError:
+                pass
+        print(f"Erreur commande {board.name} : {e}")
+        return jsonify({"error": str(e)}), 502
+    except requests.exceptions.RequestException as e:
+        print(f"Erreur commande {board.name} : {e}")
+        return jsonify({"error": str(e)}), 502
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+
+@app.route("/relay/<relay_id>/<state>", methods=["POST"])
+def relay(relay_id, state):
+    """
+    Commande un relais via le gateway (commande groupée d'un seul relai) ;
+    retourne l'état de tous les relais
+    """
+    return relay_command({relay_id: state})
+
+
+@app.route("/relays", methods=["POST"])
+def relays_batch():
+    """
+    Commande plusieurs relais en une seule requête au Pico.
+    Corps : {"1": 1, "3": 0, ...} ou {"mask": <bits>, "values": <bits>}
+    """
+    return relay_command(request.get_json(silent=True))
+
+
+@app.route("/allrelays/<state>", methods=["POST"])
+def all_relays(state):
+    """
+    Commande tous les relais via la commande groupée du Pico
+    """
+    if state not in ("0", "1"):
+        return jsonify({"error": "Invalid command"}), 400
+    return relay_command({"mask": 0xFF, "values": 0xFF if state == "1" else 0})
+
+
+@app.route("/fleet", methods=["GET"])
+def fleet_overview():
+    """
+    Retourne la page fleet.html : état de toutes les cartes, interrogées en parallèle
+    """
+    results = fleet.map(lambda board: board.mirror.get("relays"))
+    overview = []
+    for name, board in fleet.boards.items():
+        result = results[name]
+        relays, age, connected = result["result"] if result["ok"] else (None, None, False)
+        overview.append({
+            "name": name,
+            "url": board.url,
+            "connected": connected,
+            "age": age,
+            "relays_on": sum(1 for state in relays.values() if state) if isinstance(relays, dict) else None,
+            "elapsed_ms": result["elapsed_ms"],
+        })
+    return render_template("fleet.html", overview=overview, connected=any(b["connected"] for b in overview))
+
+
+@app.route("/fleet/allrelays/<state>", methods=["POST"])
+def fleet_all_relays(state):
+    """
+    Commande tous les relais de toutes les cartes en parallèle ;
+    retourne le résultat de chaque carte
+    """
+    if state not in ("0", "1"):
+        return jsonify({"error": "Invalid command"}), 400
+    payload = {"mask": 0xFF, "values": 0xFF if state == "1" else 0}
+
+    return jsonify(fleet.map(lambda board: board.command(payload)))
+
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """
+    Flux Server-Sent Events des changements de relais et des nouveaux événements
+    """
+    return Response(current_board().broker.stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
 
+@app.route("/metrics", methods=["GET"])
+def metrics_text():
+    """
+    Métriques du gateway et de chaque Pico (label board) au format Prometheus
+    """
+    results = fleet.map(lambda board: board.client.get("/metrics").text)
+    families = label_board_metrics({}, metrics.render())
+    for name, result in results.items():
+        health = fleet.boards[name].client.health
+        gauges = [
+            ("up", 1 if result["ok"] else 0),
+            ("breaker_open", 0 if health.state == health.CLOSED else 1),
+            ("timeout_seconds", f"{health.timeout:.3f}"),
+        ]
+        if health.srtt is not None:
+            gauges.append(("latency_seconds", f"{health.srtt:.4f}"))
+        for gauge, value in gauges:
+            family = f"gateway_board_{gauge}"
+            families.setdefault(family, [f"# TYPE {family} gauge"]).append(f'{family}{{board="{name}"}} {value}')
+    for name, result in results.items():
+        if result["ok"]:
+            label_board_metrics(families, result["result"], name)
+    lines = [line for family in families.values() for line in family]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain")
+
+
 @app.route("/reboot", methods=["GET","POST"])
 def reboot():
     """
     Reboot Pico
     """
-    url = URL_PICO + "/reset"
     try:
-        response = requests.get(url,timeout=3)
-        response.raise_for_status()
-        print(response.json())
+        print(current_board().client.command("/reboot"))
     except requests.exceptions.ConnectionError:
         print("Erreur : Impossible de se connecter au Pico.")
     except requests.exceptions.Timeout:
         print("Erreur : La requête a expiré.")
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Erreur générale : {e}")
     return (" ...no reboot")
 
@@ -0,0 +1,79 @@
+# Emulateur CPython du Pico W pour main.py
+# Patrick Pinard - 2024
+
+"""
+Hardware-free stand-ins for the MicroPython modules used by main.py.
+
+install() registers fake ``machine``, ``neopixel``, ``network`` and ``ntptime`` modules,
+adds the MicroPython-only helpers main.py relies on (``gc.mem_free``,
+``gc.mem_alloc``, ``time.ticks_ms``...) and makes the repository's
+``secrets.py`` importable, so that ``PicoBoardRelay`` and ``create_app``
+run unmodified on Linux. Flash writes are counted by flash.FlashCounter.
+
+Heap usage is measured with tracemalloc, started by install(). Microdot
+from PyPI runs sync handlers in a thread pool; install() makes it run
+them inline on the event loop, one at a time, as on the Pico.
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from inspect import iscoroutinefunction
+
+from . import machine, neopixel, network, ntptime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heap size of a Pico W running MicroPython (bytes)
+HEAP_SIZE = 192 * 1024
+
+
+def _mem_alloc():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def _mem_free():
+    return max(0, HEAP_SIZE - _mem_alloc())
+
+
+async def _invoke_handler(handler, *args, **kwargs):
+    """Microdot handler call without the thread pool: sync handlers block the loop"""
+    if iscoroutinefunction(handler):
+        return await handler(*args, **kwargs)
+    return handler(*args, **kwargs)
+
+
+def install():
+    """
+    Register the fake MicroPython modules; safe to call several times
+    """
+    sys.modules["machine"] = machine
+    sys.modules["neopixel"] = neopixel
+    sys.modules["network"] = network
+    sys.modules["ntptime"] = ntptime
+
+    # secrets.py of the repository shadows the standard library module
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    cached = sys.modules.get("secrets")
+    if cached is not None and not hasattr(cached, "ssid"):
+        del sys.modules["secrets"]
+
+    try:
+        import microdot.microdot
+        microdot.microdot.invoke_handler = _invoke_handler
+    except ImportError:
+        pass
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    gc.mem_alloc = _mem_alloc
+    gc.mem_free = _mem_free
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    time.ticks_diff = lambda end, start: end - start
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
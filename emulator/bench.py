@@ -0,0 +1,176 @@
+"""
+Load benchmark of both tiers against the emulated Pico:
+
+    python -m emulator.bench --requests 200 --concurrency 8
+
+Reports, per scenario, requests per second, p50/p95/p99 latency (ms) and the
+bytes written to the emulated flash per operation.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .runner import EmulatedPico
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_load(name, call, count, concurrency, pico=None):
+    """
+    Run call(i) count times on concurrency threads
+    :return: Result dict for the report
+    """
+    if pico is not None:
+        pico.settle()
+        pico.flash.reset()
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            ok = call(i)
+        except Exception:
+            ok = False
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(count)))
+    duration = time.perf_counter() - started
+
+    flash_per_op = None
+    if pico is not None:
+        pico.settle()
+        flash_per_op = pico.flash.bytes_written / count
+
+    latencies.sort()
+    return {
+        "name": name,
+        "requests": count,
+        "errors": errors[0],
+        "rps": count / duration if duration else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "flash": flash_per_op,
+    }
+
+
+def pico_scenarios(pico):
+    """Direct HTTP calls to the emulated Pico endpoints"""
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def get(path):
+        return lambda i: session().get(pico.url + path, timeout=10).ok
+
+    def toggle(i):
+        return session().post(f"{pico.url}/relay/{i % 8 + 1}/{i % 2}", timeout=10).ok
+
+    def batch(i):
+        body = {"mask": 0xFF, "values": 0xFF if i % 2 else 0}
+        return session().post(pico.url + "/relays", json=body, timeout=10).ok
+
+    return [
+        ("pico GET /relays", get("/relays")),
+        ("pico GET /system", get("/system")),
+        ("pico GET /events", get("/events")),
+        ("pico POST /relay/<id>/<state>", toggle),
+        ("pico POST /relays (batch)", batch),
+    ]
+
+
+def gateway_scenarios(pico):
+    """Flask routes of app.py, with the gateway pointed at the emulated Pico"""
+    # the emulated events must not land in the real history (same board name "pico")
+    os.environ["PICO_HISTORY_DB"] = os.path.join(tempfile.mkdtemp(prefix="pico-history-"), "history.db")
+    import app as gateway
+
+    gateway.fleet = gateway.Fleet({"pico": pico.url})
+    gateway.start_background()
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = gateway.app.test_client()
+        return local.client
+
+    def get(path):
+        return lambda i: client().get(path).status_code == 200
+
+    def toggle(i):
+        return client().post(f"/relay/{i % 8 + 1}/{i % 2}").status_code == 200
+
+    return [
+        ("gateway GET /relais", get("/relais")),
+        ("gateway GET /system", get("/system")),
+        ("gateway GET /events", get("/events")),
+        ("gateway GET /get_relay_state", get("/get_relay_state")),
+        ("gateway POST /relay/<id>/<state>", toggle),
+    ]
+
+
+def report(results):
+    header = f"{'scenario':36} {'req':>5} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'flash B/op':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        flash = "-" if r["flash"] is None else f"{r['flash']:.1f}"
+        print(f"{r['name']:36} {r['requests']:>5} {r['errors']:>4} {r['rps']:>8.1f} "
+              f"{r['p50']:>8.2f} {r['p95']:>8.2f} {r['p99']:>8.2f} {flash:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Pico endpoints and the Flask gateway")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", choices=("pico", "gateway"), default=None)
+    parser.add_argument("--verbose", action="store_true", help="show the Pico and gateway logs")
+    args = parser.parse_args()
+
+    results = []
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with logs:
+        pico = EmulatedPico().start()
+        try:
+            run_scenarios(pico, args, results)
+        finally:
+            pico.stop()
+    report(results)
+
+
+def run_scenarios(pico, args, results):
+    if args.only in (None, "pico"):
+        for name, call in pico_scenarios(pico):
+            results.append(run_load(name, call, args.requests, args.concurrency, pico))
+    if args.only in (None, "gateway"):
+        for name, call in gateway_scenarios(pico):
+            results.append(run_load(name, call, args.requests, args.concurrency, pico))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Fake ``machine`` module: Pin, ADC, RTC and reset()"""
+
+import random
+
+
+class Pin(object):
+    """GPIO pin keeping its value and the number of writes"""
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=IN, *args, **kwargs):
+        self.id = id
+        self.mode = mode
+        self._value = 0
+        self.writes = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+        self.writes += 1
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class ADC(object):
+    """
+    ADC returning noisy raw readings around plausible values:
+    channel 4 ~ 27 °C, channel 29 ~ VSYS 5 V
+    """
+    NOMINAL = {4: 14100, 29: 33100}
+    NOISE = 300
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def read_u16(self):
+        nominal = self.NOMINAL.get(self.channel, 32768)
+        return max(0, min(65535, nominal + random.randint(-self.NOISE, self.NOISE)))
+
+
+class RTC(object):
+    """Real-time clock: records the datetime set instead of changing the host clock"""
+    datetime_set = None
+
+    def datetime(self, value=None):
+        if value is None:
+            import time
+            t = time.localtime()
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+        RTC.datetime_set = value
+
+
+reset_count = 0
+
+
+def reset():
+    """Record the reset request instead of rebooting the host"""
+    global reset_count
+    reset_count += 1
+    print("machine.reset() called")
@@ -0,0 +1,23 @@
+"""Fake ``neopixel`` module"""
+
+
+class NeoPixel(object):
+    """RGB LED strip keeping the last written colours"""
+
+    def __init__(self, pin, n, *args, **kwargs):
+        self.pin = pin
+        self.n = max(1, n)
+        self._pixels = [(0, 0, 0)] * self.n
+        self.written = list(self._pixels)
+
+    def __setitem__(self, index, colour):
+        self._pixels[index] = colour
+
+    def __getitem__(self, index):
+        return self._pixels[index]
+
+    def __len__(self):
+        return self.n
+
+    def write(self):
+        self.written = list(self._pixels)
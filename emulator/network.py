@@ -0,0 +1,35 @@
+"""Fake ``network`` module: the WiFi connects on localhost after a short delay"""
+
+import time
+
+STA_IF = 0
+AP_IF = 1
+
+# Time a connection takes to come up (seconds)
+CONNECT_DELAY = 0.2
+
+
+class WLAN(object):
+    """Station interface connecting CONNECT_DELAY seconds after connect()"""
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connected_at = None
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def connect(self, ssid=None, key=None):
+        self._connected_at = time.monotonic() + CONNECT_DELAY
+
+    def disconnect(self):
+        self._connected_at = None
+
+    def isconnected(self):
+        return self._active and self._connected_at is not None and time.monotonic() >= self._connected_at
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.255.255.0", "127.0.0.1", "127.0.0.1")
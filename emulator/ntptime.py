@@ -0,0 +1,9 @@
+"""Fake ``ntptime`` module: the host clock is already set"""
+
+sync_count = 0
+
+
+def settime():
+    """Count the synchronization instead of setting the host clock"""
+    global sync_count
+    sync_count += 1
@@ -0,0 +1,128 @@
+"""
+Run main.py unmodified on the emulated Pico:
+
+    python -m emulator.runner --port 8080 --flash /tmp/pico-flash
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from . import install
+from .flash import FlashCounter
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class EmulatedPico(object):
+    """
+    PicoBoardRelay and the Microdot app from main.py, served by main.serve()
+    on a background thread with its own event loop.
+
+    Files written by main.py land in flash_dir (the process working
+    directory is switched to it) and are counted by self.flash.
+    """
+
+    def __init__(self, port=None, flash_dir=None):
+        self.port = port or free_port()
+        self.flash_dir = flash_dir or tempfile.mkdtemp(prefix="pico-flash-")
+        self.flash = FlashCounter()
+        self.main = None
+        self.board = None
+        self.app = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=5):
+        install()
+        os.makedirs(self.flash_dir, exist_ok=True)
+        os.chdir(self.flash_dir)
+
+        import main
+        self.main = main
+        self.flash.attach(main)
+        main.boot = main.BootTimeline()       # one boot per emulated Pico
+        self.board = main.PicoBoardRelay()
+        self.app = main.create_app(self.board)
+        main.boot.mark("app")
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(main.serve(self.board, self.app, self.port))
+            except asyncio.CancelledError:
+                pass
+            finally:
+                # stop the board background tasks started by serve()
+                tasks = asyncio.all_tasks(self._loop)
+                for task in tasks:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="pico", daemon=True)
+        self._thread.start()
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"emulated Pico did not start on port {self.port}")
+
+    def wait_ready(self, timeout=5):
+        """Wait until the boot is complete (event log loaded, WiFi connected, clock set)"""
+        deadline = time.monotonic() + timeout
+        while "clock" not in dict(self.main.boot.phases) and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+        async def barrier():
+            pass
+        # the loop has finished the step that marked the phase (and logged its event)
+        asyncio.run_coroutine_threadsafe(barrier(), self._loop).result(timeout)
+        return self
+
+    def settle(self, timeout=10):
+        """Wait until deferred relay state writes have reached flash"""
+        deadline = time.monotonic() + timeout
+        while self.board.store.dirty and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.app.shutdown)
+            self._thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run main.py on an emulated Pico W")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--flash", default=None, help="directory used as the Pico flash")
+    args = parser.parse_args()
+
+    pico = EmulatedPico(args.port, args.flash).start()
+    print(f"Emulated Pico on {pico.url} (flash: {pico.flash_dir})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pico.stop()
+
+
+if __name__ == "__main__":
+    main()
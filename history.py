@@ -0,0 +1,291 @@
+# Version 1 - history.py : historique persistant des événements et mesures du Pico
+# Patrick Pinard - 2024
+
+"""
+Historique SQLite du gateway : événements et mesures de chaque carte,
+conservés bien au-delà des 50 événements et de l'heure de mesures du Pico.
+"""
+
+import calendar
+import re
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    board TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    level TEXT NOT NULL,
+    message TEXT NOT NULL,
+    UNIQUE (board, seq, time)
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (board, time);
+CREATE INDEX IF NOT EXISTS events_level ON events (board, level, time);
+
+CREATE TABLE IF NOT EXISTS switches (
+    event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+    board TEXT NOT NULL,
+    relay INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS switches_relay ON switches (board, relay, time);
+CREATE INDEX IF NOT EXISTS switches_event ON switches (event_id);
+
+CREATE TABLE IF NOT EXISTS samples (
+    board TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    min REAL,
+    avg REAL,
+    max REAL,
+    PRIMARY KEY (board, metric, resolution, time)
+);
+"""
+
+METRICS = ("temperature", "voltage", "mem_free", "mem_alloc")
+LEVELS = ("INFO", "WARNING", "ERROR")
+
+# Messages de commutation du Pico : "Relay 3 set to 1", "Relays set 1=1 3=0",
+# "Relays set 5=1 (schedule start 2)", "All relays set to 0" ; les anciennes
+# versions écrivaient "Schedule start 2: relays set 5=1"
+RELAY_SET = re.compile(r"Relay (\d+) set to ([01])")
+RELAYS_SET = re.compile(r"[Rr]elays set ((?:\d+=[01] ?)+)")
+ALL_RELAYS_SET = re.compile(r"All relays set to ([01])")
+
+
+def parse_switches(message, relays=8):
+    """
+    Retourne la liste [(relai, état)] décrite par un message d'événement
+    """
+    match = RELAY_SET.search(message)
+    if match:
+        return [(int(match.group(1)), int(match.group(2)))]
+    match = RELAYS_SET.search(message)
+    if match:
+        return [tuple(int(x) for x in pair.split("=")) for pair in match.group(1).split()]
+    match = ALL_RELAYS_SET.search(message)
+    if match:
+        return [(relay, int(match.group(1))) for relay in range(1, relays + 1)]
+    return []
+
+
+def event_epoch(event):
+    """
+    Horodatage epoch d'un événement du Pico ("date" jj/mm/aaaa, "time" hh:mm:ss,
+    heure du Pico considérée comme UTC)
+    """
+    day, month, year = (int(x) for x in event["date"].split("/"))
+    hour, minute, second = (int(x) for x in event["time"].split(":"))
+    return calendar.timegm((year, month, day, hour, minute, second, 0, 0, 0))
+
+
+def parse_time(value, default=None):
+    """
+    Convertit un paramètre de requête en epoch : nombre de secondes,
+    date "aaaa-mm-jj" ou date et heure "aaaa-mm-jjThh:mm[:ss]" (UTC)
+    """
+    if value in (None, ""):
+        return default
+    if value.isdigit():
+        return int(value)
+    for pattern in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, pattern))
+        except ValueError:
+            pass
+    raise ValueError(f"Date invalide : {value}")
+
+
+class HistoryStore(object):
+    """
+    Historique SQLite des événements et des mesures de toutes les cartes.
+
+    Les écritures sont regroupées : add_events() et add_samples() ne font
+    qu'ajouter des lignes en attente, écrites par flush() en une seule
+    transaction. Chaque événement de commutation est aussi décomposé en
+    lignes (relai, état) indexées par relai et par date, ce qui permet de
+    calculer nombres de commutations et durées d'activation sans relire
+    les messages. maintain() applique la rétention : les mesures à la
+    minute sont regroupées par heure au-delà de `raw_days`, les mesures
+    horaires et les événements sont supprimés au-delà de `keep_days`.
+    """
+
+    def __init__(self, path, raw_days=7, keep_days=365, batch_size=500):
+        self.path = path
+        self.raw_days = raw_days
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._pending_events = []
+        self._pending_samples = []
+        self.versions = {}       # carte -> incrémenté à chaque nouvel événement écrit
+
+    def add_events(self, board, events):
+        """
+        Met en attente des événements du Pico (dicts seq, message, date, time)
+        """
+        rows = []
+        for event in events:
+            try:
+                level = event["message"].partition(": ")[0]
+                if level not in LEVELS:
+                    level = "INFO"
+                rows.append((board, int(event["seq"]), event_epoch(event), level, event["message"]))
+            except (KeyError, ValueError):
+                continue
+        with self._lock:
+            self._pending_events.extend(rows)
+            full = len(self._pending_events) >= self.batch_size
+        if full:
+            self.flush()
+
+    def add_samples(self, board, history, resolution):
+        """
+        Met en attente les mesures agrégées du Pico (réponse de /system/history)
+        """
+        rows = []
+        for bucket in history.get("buckets", []):
+            for metric in METRICS:
+                if metric in bucket:
+                    low, avg, high = bucket[metric]
+                    rows.append((board, metric, resolution, int(bucket["t"]), low, avg, high))
+        with self._lock:
+            self._pending_samples.extend(rows)
+
+    def flush(self):
+        """
+        Écrit les lignes en attente en une seule transaction
+        :return: nombre de nouveaux événements
+        """
+        with self._lock:
+            events, self._pending_events = self._pending_events, []
+            samples, self._pending_samples = self._pending_samples, []
+            if not events and not samples:
+                return 0
+            inserted = 0
+            # ordre chronologique : les commutations d'une même seconde gardent leur ordre
+            events.sort(key=lambda row: (row[2], row[1]))
+            with self.db:
+                for row in events:
+                    cursor = self.db.execute(
+                        "INSERT OR IGNORE INTO events (board, seq, time, level, message) VALUES (?, ?, ?, ?, ?)", row)
+                    if cursor.rowcount:
+                        inserted += 1
+                        self.versions[row[0]] = self.versions.get(row[0], 0) + 1
+                        self.db.executemany(
+                            "INSERT INTO switches (event_id, board, relay, state, time) VALUES (?, ?, ?, ?, ?)",
+                            [(cursor.lastrowid, row[0], relay, state, row[2])
+                             for relay, state in parse_switches(row[4])])
+                # le bucket de la minute en cours est complété à la récolte suivante
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO samples (board, metric, resolution, time, min, avg, max) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", samples)
+            return inserted
+
+    def maintain(self, now=None):
+        """
+        Rétention et sous-échantillonnage (appelé périodiquement)
+        """
+        now = int(now or time.time())
+        raw_limit = now - self.raw_days * 86400
+        keep_limit = now - self.keep_days * 86400
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO samples (board, metric, resolution, time, min, avg, max) "
+                "SELECT board, metric, 3600, time - time % 3600, MIN(min), AVG(avg), MAX(max) "
+                "FROM samples WHERE resolution < 3600 AND time < ? "
+                "GROUP BY board, metric, time - time % 3600", (raw_limit - raw_limit % 3600,))
+            self.db.execute("DELETE FROM samples WHERE resolution < 3600 AND time < ?",
+                            (raw_limit - raw_limit % 3600,))
+            self.db.execute("DELETE FROM samples WHERE time < ?", (keep_limit,))
+            self.db.execute("DELETE FROM events WHERE time < ?", (keep_limit,))
+
+    def events(self, board, start=None, end=None, level=None, relay=None, limit=20, offset=0):
+        """
+        Événements du plus récent au plus ancien, au format du Pico
+        (seq, message, date, time) avec en plus l'epoch
+        """
+        where, params = ["e.board = ?"], [board]
+        if start is not None:
+            where.append("e.time >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("e.time < ?")
+            params.append(end)
+        if level:
+            where.append("e.level = ?")
+            params.append(level)
+        if relay is not None:
+            where.append("e.id IN (SELECT event_id FROM switches WHERE board = ? AND relay = ?)")
+            params.extend([board, relay])
+        query = (f"SELECT e.seq, e.time, e.message FROM events e WHERE {' AND '.join(where)} "
+                 "ORDER BY e.time DESC, e.seq DESC LIMIT ? OFFSET ?")
+        with self._lock:
+            rows = self.db.execute(query, params + [limit, offset]).fetchall()
+        result = []
+        for row in rows:
+            t = time.gmtime(row["time"])
+            result.append({
+                "seq": row["seq"],
+                "epoch": row["time"],
+                "message": row["message"],
+                "time": time.strftime("%H:%M:%S", t),
+                "date": time.strftime("%d/%m/%Y", t),
+            })
+        return result
+
+    def relay_stats(self, board, start, end):
+        """
+        Par relai : nombre de commutations (changements d'état) et durée
+        d'activation en secondes sur l'intervalle [start, end[
+        """
+        stats = {}
+        for relay in range(1, 9):
+            with self._lock:
+                before = self.db.execute(
+                    "SELECT state FROM switches WHERE board = ? AND relay = ? AND time < ? "
+                    "ORDER BY time DESC, event_id DESC LIMIT 1", (board, relay, start)).fetchone()
+                rows = self.db.execute(
+                    "SELECT state, time FROM switches WHERE board = ? AND relay = ? AND time >= ? AND time < ? "
+                    "ORDER BY time, event_id", (board, relay, start, end)).fetchall()
+            state = before["state"] if before else 0
+            since = start
+            on_time = switches = 0
+            for row in rows:
+                if row["state"] == state:
+                    continue
+                if state:
+                    on_time += row["time"] - since
+                state, since = row["state"], row["time"]
+                switches += 1
+            if state:
+                on_time += end - since
+            stats[str(relay)] = {"switches": switches, "on_time": on_time}
+        return stats
+
+    def samples(self, board, metric, start, end, resolution=None):
+        """
+        Mesures [{t, min, avg, max}] d'une métrique ; sans résolution, la plus
+        fine disponible sur l'intervalle
+        """
+        with self._lock:
+            if resolution is None:
+                row = self.db.execute("SELECT MIN(resolution) FROM samples WHERE board = ? AND metric = ? "
+                                      "AND time >= ? AND time < ?", (board, metric, start, end)).fetchone()
+                resolution = row[0] or 60
+            rows = self.db.execute(
+                "SELECT time, min, avg, max FROM samples WHERE board = ? AND metric = ? AND resolution = ? "
+                "AND time >= ? AND time < ? ORDER BY time", (board, metric, resolution, start, end)).fetchall()
+        return {"resolution": resolution,
+                "points": [{"t": r["time"], "min": r["min"], "avg": r["avg"], "max": r["max"]} for r in rows]}
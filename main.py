@@ -3,13 +3,20 @@
 
 
 import json
-import mm_wlan
 from secrets import ssid, pwd, location, contact
 from time import localtime, sleep
-from machine import Pin, ADC, reset
+from machine import Pin, ADC, RTC, reset
 import neopixel
 import gc
 import time
+import os
+import struct
+import heapq
+from array import array
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 class Config:
     """Centralized configuration management"""
@@ -31,33 +38,989 @@ class Config:
     LED_PIN = 13
     BUZZER_PIN = 6
     ONBOARD_LED_PIN = "LED"
-    STATE_FILE = "relay_states.json"
+    STATE_FILE = "relay_states.dat"
+    LEGACY_STATE_FILE = "relay_states.json"   # migrated once to STATE_FILE
+    STATE_FLUSH_DEBOUNCE_MS = 500
+    STATE_FLUSH_MAX_DELAY_MS = 5000
     MAX_EVENTS = 50
-    EVENTS_FILE = "events.json"
+    EVENTS_FILE = "events.json"          # legacy format, migrated once to EVENT_LOG_FILE
+    EVENT_LOG_FILE = "events.log"
+    EVENT_LEVELS = ("INFO", "WARNING", "ERROR")
+    TELEMETRY_INTERVAL_S = 15
+    TELEMETRY_HISTORY = 240              # samples kept (1 hour at 15 s)
+    ADC_SAMPLES = 8                      # ADC reads averaged per sample
+    SCHEDULE_FILE = "schedule.dat"
+    MAX_JOBS = 16
+    SCHEDULE_TICK_S = 1
+    CLOCK_JUMP_S = 60                    # clock corrections (NTP) beyond this reschedule the jobs
+    STREAM_ALLOC_LIMIT = 4096            # heap growth while streaming a response before a gc.collect()
+    MAX_CONTROL_SOCKETS = 2              # concurrent WebSocket control channels
+    WIFI_TIMEOUT_S = 20                  # connection attempt before it is restarted
+    WIFI_POLL_MS = 100
+    NTP_ATTEMPTS = 5
+    NTP_RETRY_S = 10
+    TIME_OFFSET_S = 0                    # board time = UTC + offset (daily jobs, event dates)
+
+class Metrics(object):
+    """
+    Fixed-memory latency histograms, rendered in Prometheus text format.
+
+    A series is kept per (kind, name): kind is "route" for HTTP handlers and
+    "call" for internal hot paths. Each series holds a count, the latency sum,
+    the heap allocated during the calls, the peak heap growth of a single
+    call and one counter per latency bucket; the set of series is bounded by
+    the instrumented code.
+    """
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000)
+
+    def __init__(self, prefix="pico"):
+        self.prefix = prefix
+        self.series = {}
+
+    def observe(self, kind, name, elapsed_ms, allocated=0, error=False, peak=0):
+        key = (kind, name)
+        series = self.series.get(key)
+        if series is None:
+            # [count, latency sum (ms), allocated bytes, errors, bucket counters, peak bytes]
+            series = self.series[key] = [0, 0, 0, 0, array('I', [0] * (len(self.BUCKETS_MS) + 1)), 0]
+        series[0] += 1
+        series[1] += elapsed_ms
+        series[2] += max(0, allocated)
+        if error:
+            series[3] += 1
+        if peak > series[5]:
+            series[5] = peak
+        buckets = series[4]
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if elapsed_ms <= bound:
+                buckets[i] += 1
+                return
+        buckets[-1] += 1
+
+    def timed(self, name):
+        """Decorator recording the latency of an internal call"""
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                started = time.ticks_ms()
+                error = True
+                try:
+                    result = func(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    self.observe("call", name, time.ticks_diff(time.ticks_ms(), started), error=error)
+            return wrapper
+        return decorator
+
+    def lines(self, gauges=None):
+        """Yield the exposition lines, each metric family as one block under its TYPE line"""
+        for kind in ("route", "call"):
+            family = f"{self.prefix}_{kind}"
+            series = [(name, values) for (series_kind, name), values in self.series.items() if series_kind == kind]
+            yield f"# TYPE {family}_latency_ms histogram"
+            for name, (count, total, allocated, errors, buckets, peak) in series:
+                labels = f'{kind}="{name}"'
+                cumulative = 0
+                for i, bound in enumerate(self.BUCKETS_MS):
+                    cumulative += buckets[i]
+                    yield f'{family}_latency_ms_bucket{{{labels},le="{bound}"}} {cumulative}'
+                yield f'{family}_latency_ms_bucket{{{labels},le="+Inf"}} {count}'
+                yield f'{family}_latency_ms_sum{{{labels}}} {total}'
+                yield f'{family}_latency_ms_count{{{labels}}} {count}'
+            # (suffix, type, index in the series)
+            scalars = [("errors_total", "counter", 3)]
+            if kind == "route":
+                scalars += [("alloc_bytes_total", "counter", 2), ("peak_alloc_bytes", "gauge", 5)]
+            for suffix, metric_type, index in scalars:
+                yield f"# TYPE {family}_{suffix} {metric_type}"
+                for name, values in series:
+                    yield f'{family}_{suffix}{{{kind}="{name}"}} {values[index]}'
+        for name, value in (gauges or {}).items():
+            yield f"# TYPE {self.prefix}_{name} gauge"
+            yield f"{self.prefix}_{name} {value}"
+
+    def render(self, gauges=None):
+        return "\n".join(self.lines(gauges)) + "\n"
+
+metrics = Metrics()
+
+class BootTimeline(object):
+    """
+    Milliseconds spent in each boot phase, exposed in /system to follow the
+    restore-to-ready time after a reset. "start" is the tick count when
+    main.py started running, i.e. the firmware boot and module imports.
+    """
+
+    def __init__(self):
+        self.started = self._last = time.ticks_ms()
+        self.phases = []        # (phase, ms since the previous mark)
+
+    def mark(self, phase):
+        """Close the current phase"""
+        now = time.ticks_ms()
+        self.phases.append((phase, time.ticks_diff(now, self._last)))
+        self._last = now
+
+    def to_dict(self):
+        timeline = {'start': self.started}
+        for phase, ms in self.phases:
+            timeline[phase] = ms
+        timeline['total'] = time.ticks_diff(self._last, self.started)
+        return timeline
+
+boot = BootTimeline()
+
+class EventLog(object):
+    """
+    Append-only event log stored on flash as a ring of fixed-size records.
+
+    Each record holds a sequence number, an epoch timestamp, a level code and
+    the message. Appending an event is a single seek+write of one record at
+    slot seq % capacity; the head pointer is recovered at boot as the highest
+    sequence number found in the file, so no header has to be rewritten.
+    In RAM the ring is one preallocated bytearray holding the same records:
+    no per-event objects are kept, and messages are decoded and dates
+    formatted only while serializing.
+    """
+    RECORD_FORMAT = "<IIBB86s"
+    HEADER_FORMAT = "<IIBB"                        # seq, epoch, level, message length
+    RECORD_SIZE = struct.calcsize(RECORD_FORMAT)   # 96 bytes
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)   # 10 bytes
+    MESSAGE_SIZE = 86
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.last_seq = 0
+        self._buffer = bytearray(capacity * self.RECORD_SIZE)
+        self.loaded = False
+
+    def load(self):
+        """
+        Read the ring from flash, formatting a new file if missing or invalid.
+        Called once the server is up: until then the ring reads as empty.
+        """
+        self.loaded = True
+        try:
+            if os.stat(self.path)[6] != len(self._buffer):
+                raise OSError("invalid event log size")
+            with open(self.path, 'rb') as f:
+                f.readinto(self._buffer)
+            for slot in range(self.capacity):
+                seq = struct.unpack_from("<I", self._buffer, slot * self.RECORD_SIZE)[0]
+                if seq % self.capacity != slot:
+                    struct.pack_into("<I", self._buffer, slot * self.RECORD_SIZE, 0)
+                elif seq > self.last_seq:
+                    self.last_seq = seq
+        except OSError:
+            self._buffer = bytearray(len(self._buffer))
+            with open(self.path, 'wb') as f:
+                f.write(self._buffer)
+
+    def _record(self, seq):
+        """Record tuple (seq, epoch, level, message) stored for seq, or None"""
+        offset = (seq % self.capacity) * self.RECORD_SIZE
+        stored, epoch, level, length = struct.unpack_from(self.HEADER_FORMAT, self._buffer, offset)
+        if stored != seq or seq == 0:
+            return None
+        start = offset + self.HEADER_SIZE
+        return (seq, epoch, level, bytes(self._buffer[start:start + length]).decode())
+
+    @metrics.timed("event_log_append")
+    def append(self, level, message, epoch=None):
+        """
+        Append one event to the ring
+        :param level: Level code (index in Config.EVENT_LEVELS)
+        :param message: Event message without level prefix
+        :param epoch: Timestamp in seconds, defaults to now
+        :return: The stored record tuple (seq, epoch, level, message)
+        """
+        if epoch is None:
+            epoch = int(time.time())
+        data = message.encode()
+        while len(data) > self.MESSAGE_SIZE:
+            message = message[:-1]
+            data = message.encode()
+
+        seq = self.last_seq + 1
+        offset = (seq % self.capacity) * self.RECORD_SIZE
+        struct.pack_into(self.RECORD_FORMAT, self._buffer, offset, seq, epoch, level, len(data), data)
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            f.write(memoryview(self._buffer)[offset:offset + self.RECORD_SIZE])
+
+        self.last_seq = seq
+        return (seq, epoch, level, message)
+
+    def records(self, since=0, limit=None):
+        """
+        Yield records newest-first
+        :param since: Only records with a sequence number above this one
+        :param limit: Maximum number of records. Without a cursor the newest
+                      ones; with a cursor the ones right after it
+        """
+        first = max(since, self.last_seq - self.capacity) + 1
+        seq = self.last_seq
+        if limit is not None:
+            if since:
+                seq = min(seq, first - 1 + limit)
+            else:
+                first = max(first, seq - limit + 1)
+        while seq >= first:
+            record = self._record(seq)
+            if record is not None:
+                yield record
+            seq -= 1
+
+    def migrate(self, json_path):
+        """
+        One-time import of a legacy events.json (newest-first list of dicts).
+        The JSON file is removed once its events are in the ring.
+        """
+        try:
+            with open(json_path, 'r') as f:
+                events = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if self.last_seq == 0:
+            for event in reversed(events[:self.capacity]):
+                try:
+                    day, month, year = [int(x) for x in event['date'].split('/')]
+                    hour, minute, second = [int(x) for x in event['time'].split(':')]
+                    epoch = int(time.mktime((year, month, day, hour, minute, second, 0, 0, -1)))
+                except (KeyError, ValueError):
+                    epoch = 0
+                level, message = parse_level(event.get('message', ''))
+                self.append(level, message, epoch)
+        os.remove(json_path)
+
+    @staticmethod
+    def to_json(record):
+        """Format a record as the API event JSON (same fields as to_dict, without the dict)"""
+        seq, epoch, level, message = record
+        t = localtime(epoch)
+        return '{"seq": %d, "message": %s, "time": "%02d:%02d:%02d", "date": "%02d/%02d/%d"}' % (
+            seq, json.dumps(f"{Config.EVENT_LEVELS[level]}: {message}"), t[3], t[4], t[5], t[2], t[1], t[0])
+
+    @staticmethod
+    def to_dict(record):
+        """Format a record as the API event dict (dates formatted here only)"""
+        seq, epoch, level, message = record
+        t = localtime(epoch)
+        return {
+            'seq': seq,
+            'message': f"{Config.EVENT_LEVELS[level]}: {message}",
+            'time': "{:02d}:{:02d}:{:02d}".format(t[3], t[4], t[5]),
+            'date': "{:02d}/{:02d}/{}".format(t[2], t[1], t[0])  # jour/mois/année
+        }
+
+class RelayStore(object):
+    """
+    Relay states kept as a bitmask (bit 0 = relay "1") with coalesced writes.
+
+    Changes only mark the store dirty; the run() task flushes once the states
+    have been stable for the debounce window, or at the latest after the
+    maximum delay. A flush writes a 2-byte record (mask, inverted mask) to a
+    temporary file renamed over the state file, so a power cut leaves either
+    the previous or the new record. Flushes are skipped when the mask on
+    flash is already current.
+    """
+
+    def __init__(self, path, debounce_ms=Config.STATE_FLUSH_DEBOUNCE_MS,
+                 max_delay_ms=Config.STATE_FLUSH_MAX_DELAY_MS):
+        self.path = path
+        self.debounce_ms = debounce_ms
+        self.max_delay_ms = max_delay_ms
+        self.mask = 0
+        self._saved_mask = None
+        self._dirty_since = None
+        self._changed_at = None
+
+    def load(self, legacy_path=None):
+        """
+        Restore the mask from flash, importing a legacy JSON state file if needed
+        :return: Boolean indicating whether saved states were found
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(2)
+            if len(data) == 2 and data[0] ^ data[1] == 0xFF:
+                self.mask = self._saved_mask = data[0]
+                return True
+        except OSError:
+            pass
+
+        if legacy_path:
+            try:
+                with open(legacy_path, 'r') as f:
+                    states = json.load(f)
+                for relay_id, state in states.items():
+                    self.set(relay_id, state in (True, 1, "1"))
+                self.flush()
+                os.remove(legacy_path)
+                return True
+            except (OSError, ValueError, AttributeError):
+                pass
+        return False
+
+    @staticmethod
+    def bit(relay_id):
+        return 1 << (int(relay_id) - 1)
+
+    def get(self, relay_id):
+        return bool(self.mask & self.bit(relay_id))
+
+    def set(self, relay_id, value):
+        if value:
+            mask = self.mask | self.bit(relay_id)
+        else:
+            mask = self.mask & ~self.bit(relay_id)
+        if mask != self.mask:
+            self.mask = mask
+            self.mark_dirty()
+
+    def states(self):
+        """Relay states as the API dict"""
+        return {relay_id: self.get(relay_id) for relay_id in Config.RELAY_PINS}
+
+    def mark_dirty(self):
+        now = time.ticks_ms()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        self._changed_at = now
+
+    @property
+    def dirty(self):
+        return self._dirty_since is not None
+
+    def due(self):
+        """True when a pending change should be flushed now"""
+        if self._dirty_since is None:
+            return False
+        now = time.ticks_ms()
+        return (time.ticks_diff(now, self._changed_at) >= self.debounce_ms
+                or time.ticks_diff(now, self._dirty_since) >= self.max_delay_ms)
+
+    @metrics.timed("relay_store_flush")
+    def flush(self):
+        """
+        Write the mask atomically if it differs from the saved one
+        :return: Boolean indicating whether flash was written
+        """
+        if self.mask == self._saved_mask:
+            self._dirty_since = self._changed_at = None
+            return False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(bytes((self.mask, self.mask ^ 0xFF)))
+        os.rename(tmp_path, self.path)
+        # cleared only once written: a failed write stays dirty and is retried
+        self._saved_mask = self.mask
+        self._dirty_since = self._changed_at = None
+        return True
+
+    async def run(self, on_error=None, retry_s=1):
+        """
+        Background task flushing pending changes. A failed write leaves the
+        store dirty: it is retried every retry_s seconds, on_error being
+        called on the first failure only
+        """
+        failing = False
+        while True:
+            await asyncio.sleep(0.1)
+            if self.due():
+                try:
+                    self.flush()
+                    failing = False
+                except OSError as e:
+                    if on_error and not failing:
+                        on_error(e)
+                    failing = True
+                    await asyncio.sleep(retry_s)
+
+class Telemetry(object):
+    """
+    Periodic sampler of CPU temperature, VSYS voltage and heap usage.
+
+    Each sample averages several ADC reads and is stored in preallocated
+    ring buffers (one array per metric), so sampling does not allocate and
+    /system can be served from the latest snapshot. history() reduces the
+    buffers to min/avg/max buckets on demand.
+    """
+    METRICS = ("temperature", "voltage", "mem_free", "mem_alloc")
+
+    def __init__(self, size=Config.TELEMETRY_HISTORY, interval_s=Config.TELEMETRY_INTERVAL_S,
+                 adc_samples=Config.ADC_SAMPLES):
+        self.size = size
+        self.interval_s = interval_s
+        self.adc_samples = adc_samples
+        self.sensor_temp = ADC(4)
+        self.vsys = ADC(29)
+        self.times = array('I', [0] * size)
+        self.values = {name: array('f', [0.0] * size) for name in self.METRICS}
+        self.count = 0
+
+    def _read_average(self, adc):
+        total = 0
+        for _ in range(self.adc_samples):
+            total += adc.read_u16()
+        return total / self.adc_samples
+
+    def read_temperature(self):
+        conversion_factor = 3.3 / (65535)
+        reading = self._read_average(self.sensor_temp) * conversion_factor
+        return 27 - (reading - 0.706)/0.001721
+
+    def read_voltage(self):
+        conversion_factor = 3 * 3.3 / 65535
+        return self._read_average(self.vsys) * conversion_factor * 100
+
+    @metrics.timed("telemetry_sample")
+    def sample(self):
+        """Take one averaged sample into the ring buffers"""
+        slot = self.count % self.size
+        self.times[slot] = int(time.time())
+        self.values["temperature"][slot] = self.read_temperature()
+        self.values["voltage"][slot] = self.read_voltage()
+        self.values["mem_free"][slot] = gc.mem_free()
+        self.values["mem_alloc"][slot] = gc.mem_alloc()
+        self.count += 1
+
+    def latest(self):
+        """Latest sample as a dict (takes one first if needed)"""
+        if self.count == 0:
+            self.sample()
+        slot = (self.count - 1) % self.size
+        snapshot = {name: self.values[name][slot] for name in self.METRICS}
+        snapshot["time"] = self.times[slot]
+        return snapshot
+
+    def history(self, resolution):
+        """
+        Downsample the buffered samples into time buckets
+        :param resolution: Bucket width in seconds (at least one interval)
+        :return: List of {"t": bucket start, metric: [min, avg, max], ...}, oldest first
+        """
+        resolution = max(int(resolution), self.interval_s)
+        buckets = []
+        current = None
+        first = max(0, self.count - self.size)
+        for n in range(first, self.count):
+            slot = n % self.size
+            start = self.times[slot] - self.times[slot] % resolution
+            if current is None or current["t"] != start:
+                current = {"t": start, "n": 0}
+                for name in self.METRICS:
+                    current[name] = [None, 0.0, None]
+                buckets.append(current)
+            current["n"] += 1
+            for name in self.METRICS:
+                value = self.values[name][slot]
+                stats = current[name]
+                stats[0] = value if stats[0] is None else min(stats[0], value)
+                stats[1] += value
+                stats[2] = value if stats[2] is None else max(stats[2], value)
+        for bucket in buckets:
+            n = bucket.pop("n")
+            for name in self.METRICS:
+                stats = bucket[name]
+                stats[1] = stats[1] / n
+                bucket[name] = [round(stats[0], 2), round(stats[1], 2), round(stats[2], 2)]
+        return buckets
+
+    async def run(self):
+        """Background sampling task"""
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval_s)
+
+class Scheduler(object):
+    """
+    On-device relay scheduler.
+
+    A job switches a set of relays (mask, values) once at a given time, every
+    day at a time of day (optionally on some weekdays only) or every N
+    seconds, and may switch them back after a duration. Pending actions are
+    kept in a heap ordered by due time; the run() task pops every action due
+    at the current tick and applies them as one batch, so jobs firing
+    together cost one pin update, one state write and one event. Jobs are
+    stored as fixed-size records, rewritten only when a job is created,
+    changed, removed or completed.
+    """
+    KINDS = ("once", "daily", "interval")
+    RECORD_FORMAT = "<BBBBBIII"     # id, kind, enabled, mask, values, start, period, duration
+    END, START = 0, 1               # at the same tick, ends are applied before starts
+
+    def __init__(self, path, apply, max_jobs=Config.MAX_JOBS):
+        """
+        :param path: Job file on flash
+        :param apply: Callable(mask, values, reason) switching the relays
+        :param max_jobs: Maximum number of jobs
+        """
+        self.path = path
+        self.apply = apply
+        self.max_jobs = max_jobs
+        self.record_size = struct.calcsize(self.RECORD_FORMAT)
+        self.jobs = {}
+        self._heap = []
+        self._gen = 0               # heap entries of a changed or removed job go stale
+
+    def load(self):
+        """
+        Restore jobs from flash and schedule them
+        :return: Number of jobs restored
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return 0
+        for offset in range(0, len(data) - self.record_size + 1, self.record_size):
+            job_id, kind, enabled, mask, values, start, period, duration = struct.unpack_from(
+                self.RECORD_FORMAT, data, offset)
+            self.jobs[job_id] = {'id': job_id, 'kind': kind, 'enabled': bool(enabled),
+                                 'mask': mask, 'values': values, 'start': start,
+                                 'period': period, 'duration': duration,
+                                 'gen': 0, 'active_until': None}
+        self.reschedule(int(time.time()))
+        return len(self.jobs)
+
+    def pack(self, job):
+        """Job as a flash record"""
+        return struct.pack(self.RECORD_FORMAT, job['id'], job['kind'], job['enabled'],
+                           job['mask'], job['values'], job['start'],
+                           job['period'], job['duration'])
+
+    def save(self):
+        """Write all jobs atomically (temporary file renamed over the job file)"""
+        data = b"".join(self.pack(job) for job in self.jobs.values())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, self.path)
+
+    def next_start(self, job, after):
+        """Next start time strictly after the given epoch, or None"""
+        kind, start, period = job['kind'], job['start'], job['period']
+        if kind == 0:
+            return start if start > after else None
+        if kind == 2:
+            if start > after:
+                return start
+            return start + ((after - start) // period + 1) * period
+        t = localtime(after)
+        midnight = after - (t[3] * 3600 + t[4] * 60 + t[5])
+        for day in range(8):
+            candidate = midnight + day * 86400 + start
+            if candidate > after and (not period or period & (1 << ((t[6] + day) % 7))):
+                return candidate
+        return None
+
+    def previous_start(self, job, now):
+        """Latest start time at or before now, or None"""
+        kind, start, period = job['kind'], job['start'], job['period']
+        if kind == 0:
+            return start if start <= now else None
+        if kind == 2:
+            return start + ((now - start) // period) * period if start <= now else None
+        t = localtime(now)
+        midnight = now - (t[3] * 3600 + t[4] * 60 + t[5])
+        for day in range(8):
+            candidate = midnight - day * 86400 + start
+            if candidate <= now and (not period or period & (1 << ((t[6] - day) % 7))):
+                return candidate
+        return None
+
+    def _push(self, due, action, job):
+        heapq.heappush(self._heap, (due, action, job['id'], job['gen']))
+
+    def _schedule(self, job, now):
+        """
+        Queue the next start of a job. A job created or restored inside its
+        duration window is started at once, with the end of that window.
+        :return: Boolean indicating whether the job has anything left to do
+        """
+        self._gen += 1
+        job['gen'] = self._gen
+        job['active_until'] = None
+        if not job['enabled']:
+            return True
+        previous = self.previous_start(job, now)
+        if job['duration'] and previous is not None and previous + job['duration'] > now:
+            self._push(previous, self.START, job)
+            return True
+        start = self.next_start(job, now)
+        if start is None:
+            return False
+        self._push(start, self.START, job)
+        return True
+
+    def _release(self, job):
+        """(mask, values) switching back the relays of a job inside its window"""
+        if job['active_until'] is None:
+            return 0, 0
+        job['active_until'] = None
+        return job['mask'], ~job['values'] & 0xFF
+
+    def reschedule(self, now):
+        """Rebuild the heap (after a restore or a clock correction)"""
+        self._heap = []
+        mask = values = 0
+        for job in list(self.jobs.values()):
+            m, v = self._release(job)
+            mask, values = mask | m, (values & ~m) | (v & m)
+            if not self._schedule(job, now):
+                del self.jobs[job['id']]
+        if mask:
+            self.apply(mask, values, "schedule rebuilt")
+
+    @metrics.timed("scheduler_fire")
+    def fire(self, now):
+        """
+        Apply every action due at now as one relay batch
+        :return: (started job ids, ended job ids)
+        """
+        mask = values = 0
+        started, ended = [], []
+        while self._heap and self._heap[0][0] <= now:
+            due, action, job_id, gen = heapq.heappop(self._heap)
+            job = self.jobs.get(job_id)
+            if job is None or job['gen'] != gen:
+                continue                  # job changed or removed since queued
+            if action == self.START:
+                m, v = job['mask'], job['values']
+                if job['duration']:
+                    job['active_until'] = due + job['duration']
+                    self._push(job['active_until'], self.END, job)
+                start = self.next_start(job, due)
+                if start is not None:
+                    self._push(start, self.START, job)
+                started.append(job_id)
+            else:
+                m, v = self._release(job)
+                ended.append(job_id)
+            mask |= m
+            values = (values & ~m) | (v & m)
+
+        if not started and not ended:
+            return started, ended
+        parts = []
+        if started:
+            parts.append("start " + ",".join(str(job_id) for job_id in started))
+        if ended:
+            parts.append("end " + ",".join(str(job_id) for job_id in ended))
+        self.apply(mask, values, f"schedule {' / '.join(parts)}")
+
+        # One-shot jobs are removed once completed
+        done = [job_id for job_id in started + ended
+                if job_id in self.jobs and self.jobs[job_id]['kind'] == 0
+                and self.jobs[job_id]['active_until'] is None]
+        if done:
+            for job_id in done:
+                del self.jobs[job_id]
+            self.save()
+        return started, ended
+
+    def parse(self, body, job_id):
+        """
+        Build a job from an API dict
+        {"kind": "once"|"daily"|"interval", "relays": {"3": 1} or "mask"/"values",
+         "start": <epoch> (once, interval), "time": "HH:MM[:SS]" and "days": [0..6] (daily),
+         "every": <seconds> (interval), "duration": <seconds>, "enabled": true}
+        :raises ValueError: on an invalid job
+        """
+        if not isinstance(body, dict) or body.get('kind') not in self.KINDS:
+            raise ValueError("kind must be once, daily or interval")
+        kind = self.KINDS.index(body['kind'])
+        if 'mask' in body:
+            mask, values = int(body['mask']) & 0xFF, int(body.get('values', 0)) & 0xFF
+        else:
+            mask = values = 0
+            for relay_id, state in (body.get('relays') or {}).items():
+                if str(relay_id) not in Config.RELAY_PINS or state not in (0, 1, "0", "1"):
+                    raise ValueError(f"Invalid relay {relay_id}={state}")
+                bit = RelayStore.bit(relay_id)
+                mask |= bit
+                if int(state):
+                    values |= bit
+        if not mask:
+            raise ValueError("No relay selected")
+
+        duration = int(body.get('duration', 0))
+        period = 0
+        if kind == 1:
+            parts = [int(part) for part in str(body.get('time', '')).split(':')]
+            if not 2 <= len(parts) <= 3:
+                raise ValueError("time must be HH:MM[:SS]")
+            start = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0)
+            if not 0 <= start < 86400:
+                raise ValueError("time must be HH:MM[:SS]")
+            for day in body.get('days') or ():
+                if not 0 <= int(day) <= 6:
+                    raise ValueError("days must be 0 (Monday) to 6 (Sunday)")
+                period |= 1 << int(day)
+            if duration >= 86400:
+                raise ValueError("duration must be shorter than a day")
+        else:
+            start = int(body.get('start', 0))
+            if kind == 2:
+                period = int(body.get('every', 0))
+                if period <= 0 or duration >= period:
+                    raise ValueError("every must be positive and longer than duration")
+        for name, value in (('start', start), ('every', period), ('duration', duration)):
+            if not 0 <= value <= 0xFFFFFFFF:
+                raise ValueError(f"{name} must be between 0 and 4294967295")
+        return {'id': job_id, 'kind': kind, 'enabled': bool(body.get('enabled', True)),
+                'mask': mask, 'values': values, 'start': start, 'period': period,
+                'duration': duration, 'gen': 0, 'active_until': None}
+
+    def to_dict(self, job, now):
+        """Job as an API dict"""
+        result = {
+            'id': job['id'],
+            'kind': self.KINDS[job['kind']],
+            'enabled': job['enabled'],
+            'relays': {relay_id: int(bool(job['values'] & RelayStore.bit(relay_id)))
+                       for relay_id in Config.RELAY_PINS if job['mask'] & RelayStore.bit(relay_id)},
+            'duration': job['duration'],
+            'next': self.next_start(job, now) if job['enabled'] else None,
+            'active_until': job['active_until'],
+        }
+        if job['kind'] == 1:
+            start = job['start']
+            result['time'] = f"{start // 3600:02d}:{start // 60 % 60:02d}:{start % 60:02d}"
+            result['days'] = [day for day in range(7) if job['period'] & (1 << day)]
+        else:
+            result['start'] = job['start']
+            if job['kind'] == 2:
+                result['every'] = job['period']
+        return result
+
+    def list(self):
+        """All jobs as API dicts, by id"""
+        now = int(time.time())
+        return [self.to_dict(self.jobs[job_id], now) for job_id in sorted(self.jobs)]
+
+    def add(self, body):
+        """
+        Create a job
+        :return: The job as an API dict
+        :raises ValueError: on an invalid job or when the table is full
+        :raises OSError: when the job file cannot be written (the job is dropped)
+        """
+        if len(self.jobs) >= self.max_jobs:
+            raise ValueError(f"At most {self.max_jobs} jobs")
+        job_id = 1
+        while job_id in self.jobs:
+            job_id += 1
+        job = self.parse(body, job_id)
+        now = int(time.time())
+        if not self._schedule(job, now):
+            raise ValueError("start is in the past")
+        self.jobs[job_id] = job
+        try:
+            self.save()
+        except OSError:
+            del self.jobs[job_id]       # its queued actions are skipped by fire()
+            raise
+        return self.to_dict(job, now)
+
+    def update(self, job_id, body):
+        """
+        Replace a job; relays held by a running duration window are released first
+        :return: The job as an API dict, or None if the job does not exist
+        :raises ValueError: on an invalid job
+        :raises OSError: when the job file cannot be written (the previous job is kept)
+        """
+        previous = self.jobs.get(job_id)
+        if previous is None:
+            return None
+        job = self.parse(body, job_id)
+        now = int(time.time())
+        if not self._schedule(job, now):
+            raise ValueError("start is in the past")
+        self.jobs[job_id] = job
+        try:
+            self.save()
+        except OSError:
+            # the previous job's queued actions still carry its generation
+            self.jobs[job_id] = previous
+            raise
+        self._stop(previous)
+        return self.to_dict(job, now)
+
+    def remove(self, job_id):
+        """
+        Delete a job, releasing its relays if its duration window is running
+        :return: Boolean indicating whether the job existed
+        :raises OSError: when the job file cannot be written (the job is kept)
+        """
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return False
+        try:
+            self.save()
+        except OSError:
+            self.jobs[job_id] = job
+            raise
+        self._stop(job)
+        return True
+
+    def _stop(self, job):
+        mask, values = self._release(job)
+        if mask:
+            self.apply(mask, values, f"schedule job {job['id']} stopped")
+
+    async def run(self, tick_s=Config.SCHEDULE_TICK_S, on_error=None):
+        """Background task firing due jobs, rescheduling them when the clock is corrected"""
+        last_time, last_ticks = int(time.time()), time.ticks_ms()
+        while True:
+            await asyncio.sleep(tick_s)
+            now, ticks = int(time.time()), time.ticks_ms()
+            expected = last_time + time.ticks_diff(ticks, last_ticks) // 1000
+            try:
+                if abs(now - expected) > Config.CLOCK_JUMP_S:
+                    self.reschedule(now)
+                self.fire(now)
+            except Exception as e:
+                # a failed save (flash error) must not stop the scheduling
+                if on_error:
+                    on_error(e)
+            last_time, last_ticks = now, ticks
+
+def parse_level(message):
+    """Split "LEVEL: text" into (level code, text); untagged messages are INFO"""
+    level, sep, text = message.partition(": ")
+    if sep and level in Config.EVENT_LEVELS:
+        return Config.EVENT_LEVELS.index(level), text
+    return 0, message
+
+def json_object(items):
+    """Stream a JSON object from (key, value) pairs, one member per chunk"""
+    yield "{"
+    separator = ""
+    for key, value in items:
+        yield f"{separator}{json.dumps(key)}: {json.dumps(value)}"
+        separator = ", "
+    yield "}"
+
+def json_array(items):
+    """Stream a JSON array from already serialized items, one item per chunk"""
+    yield "["
+    separator = ""
+    for item in items:
+        yield separator + item
+        separator = ", "
+    yield "]"
 
 class PicoBoardRelay(object):
     
     def __init__(self):
         
-        # Load log
-        #self.events = []
-        self.events=self.load_events()
+        # Ring-buffer event log, loaded by load_event_log() once the server is up;
+        # events logged during boot are kept in RAM until then
+        self.event_log = EventLog(Config.EVENT_LOG_FILE, Config.MAX_EVENTS)
+        self._boot_events = []
         
-        # Initialize relays with state tracking
+        # Restore relay outputs first, from the 2-byte state record
         self.relays = {}
-        self.relay_states = self._load_relay_states()
+        self.listeners = []      # asyncio.Event per control channel, set on state changes
+        self.store = RelayStore(Config.STATE_FILE)
+        self._load_relay_states()
+        self._setup_relays()
+        boot.mark("relays")
         
         # Initialize RGB LED and other system indicators
         self.led_rgb = neopixel.NeoPixel(Pin(Config.LED_PIN), Pin.OUT)
         self.onboard_led = Pin(Config.ONBOARD_LED_PIN, Pin.OUT)
         self.buzzer = Pin(Config.BUZZER_PIN, Pin.OUT)
-        
-        # Dynamically create relay pins
-        self._setup_relays()
+        self.wlan = None
+
+        # Relay scheduler, jobs restored from flash (run as a background task by serve())
+        self.scheduler = Scheduler(Config.SCHEDULE_FILE, self.apply_mask)
+        jobs = self.scheduler.load()
+        if jobs:
+            self.log_event(f"INFO: {jobs} scheduled jobs restored")
+
+        # Telemetry sampler (run as a background task by serve())
+        self.telemetry = Telemetry()
         self.led_rgb[0] = Config.COLORS["YELLOW"] 
         self.led_rgb.write()
-        time.sleep(0.5)
         self.log_event("INFO: Relay System Initialized")
+        boot.mark("init")
+
+    @metrics.timed("load_event_log")
+    def load_event_log(self):
+        """Load the event log (importing a legacy events.json once) and write the boot events"""
+        self.event_log.load()
+        self.event_log.migrate(Config.EVENTS_FILE)
+        events, self._boot_events = self._boot_events, None
+        for level, text, epoch in events:
+            try:
+                self.event_log.append(level, text, epoch)
+            except OSError:
+                print("ERROR: Failed to write event log")
+        boot.mark("events")
+
+    async def connect_wifi(self):
+        """
+        Connect the WiFi in the background, the server being already up:
+        the connection is polled instead of blocking the event loop, and
+        restarted after Config.WIFI_TIMEOUT_S
+        """
+        import network
+        self.wlan = network.WLAN(network.STA_IF)
+        self.wlan.active(True)
+        attempts = 0
+        while not self.wlan.isconnected():
+            if attempts:
+                self.log_event(f"WARNING: Failed to connect to WiFi (attempt {attempts})")
+                self.led_rgb[0] = Config.COLORS["RED"] 
+                self.led_rgb.write()
+                self.wlan.disconnect()
+            self.wlan.connect(ssid, pwd)
+            attempts += 1
+            deadline = time.ticks_add(time.ticks_ms(), Config.WIFI_TIMEOUT_S * 1000)
+            while not self.wlan.isconnected() and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+                await asyncio.sleep(Config.WIFI_POLL_MS / 1000)
+        boot.mark("wifi")
+        self.log_event(f"INFO: Wifi connected ({self.get_ip()})")
+        self.led_rgb[0] = Config.COLORS["GREEN"] 
+        self.led_rgb.write()
+        await self.sync_clock()
+
+    async def sync_clock(self):
+        """
+        Set the RTC from NTP. The Pico has no battery-backed clock: after a
+        power loss it restarts from the epoch, and daily or one-shot jobs
+        would fire at the wrong time. The scheduler task sees the clock jump
+        and reschedules its jobs.
+        :return: Boolean indicating whether the clock was set
+        """
+        import ntptime
+        for attempt in range(Config.NTP_ATTEMPTS):
+            try:
+                ntptime.settime()
+                break
+            except (OSError, OverflowError) as e:
+                error = e
+            await asyncio.sleep(Config.NTP_RETRY_S)
+        else:
+            self.log_event(f"WARNING: Clock not synchronized: {error}")
+            return False
+        if Config.TIME_OFFSET_S:
+            t = localtime(time.time() + Config.TIME_OFFSET_S)
+            RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+        boot.mark("clock")
+        self.log_event("INFO: Clock synchronized (NTP)")
+        return True
+
+    def get_ip(self):
+        """IP address of the WiFi interface, or 0.0.0.0 while not connected"""
+        if self.wlan is None or not self.wlan.isconnected():
+            return "0.0.0.0"
+        return self.wlan.ifconfig()[0]
 
     def _setup_relays(self):
         """Set up relay pins based on configuration"""
@@ -66,217 +1029,504 @@ class PicoBoardRelay(object):
             self.relays[relay_id] = relay_pin
             
             # Set initial state based on saved configuration
-            initial_state = self.relay_states.get(relay_id, False)
+            initial_state = self.store.get(relay_id)
             relay_pin.value(initial_state)
 
     def _load_relay_states(self):
         """Load relay states from persistent storage"""
-        try:
-            with open(Config.STATE_FILE, 'r') as f:
-                states = json.load(f)
-                self.log_event("INFO: Relay states loaded successfully")
-                return states
-        except (OSError, ValueError):
-            # Return default states if file doesn't exist or is invalid
-            default_states = {str(k): False for k in Config.RELAY_PINS.keys()}
+        if self.store.load(Config.LEGACY_STATE_FILE):
+            self.log_event("INFO: Relay states loaded successfully")
+        else:
+            # Default states (all off) if no valid state record exists
             self.log_event("WARNING: Relay states reset to default")
-            return default_states
 
+    @property
+    def relay_states(self):
+        """Current relay states, relay_id -> bool"""
+        return self.store.states()
+
+    @metrics.timed("save_relay_states")
     def save_relay_states(self):
-        """Save current relay states to persistent storage"""
+        """Flush pending relay states to persistent storage now"""
         try:
-            with open(Config.STATE_FILE, 'w') as f:
-                json.dump(self.relay_states, f)
-            #self.log_event("INFO: Relay states saved")
+            self.store.flush()
         except OSError:
             self.log_event("ERROR: Failed to save relay states")
 
-    def load_events(self):
-        """Load events log from persistent storage"""
-        try:
-            with open(Config.EVENTS_FILE, 'r') as f:
-                return json.load(f)
-        except (OSError, ValueError):
-            # Return empty events if events file doesn't exist or is invalid
-            return []
-        
-    def save_events(self):
-        """Save current events to persistent storage"""
-        try:
-            with open(Config.EVENTS_FILE, 'w') as f:
-                json.dump(self.events, f)
-            #self.log_event("INFO: Events log saved to persistent storage")
-        except OSError:
-            self.log_event("ERROR: Failed to save relay states")
+    def _on_store_error(self, error):
+        self.log_event(f"ERROR: Failed to save relay states: {error}")
+
+    def _on_scheduler_error(self, error):
+        self.log_event(f"ERROR: Scheduler: {error}")
 
+    @property
+    def events(self):
+        """Events as API dicts, newest first"""
+        return self.get_events()
 
+    def get_events(self, since=0, limit=None):
+        """
+        Events as API dicts, newest first
+        :param since: Only events with a sequence number above this cursor
+        :param limit: Maximum number of events. Without a cursor the newest
+                      events are kept; with a cursor the ones right after it,
+                      so the caller can continue from the highest seq returned
+        """
+        return [EventLog.to_dict(record) for record in self.event_log.records(since, limit)]
+
+    @metrics.timed("set_relay")
     def set_relay(self, relay_id, state):
         """
         Set a specific relay state
         :param relay_id: Relay identifier (string)
-        :param state: Boolean state (True/False)
+        :param state: State string ("0"/"1")
         :return: Boolean indicating success
         """
-        if relay_id not in self.relays:
-            self.log_event(f"ERROR: Invalid relay ID : {relay_id}. Must be between 1..8")
-            return False
-        
-        if state not in ["0","1"]:
-            self.log_event(f"ERROR: Invalid state : {state} for relay ID : {relay_id}. Must be 1 or 0")
-            return False
-        
-        # Set physical relay state
-        self.relays[relay_id].value(state)
-        
-        # Update state tracking
-        self.relay_states[relay_id] = state
-        
-        # Log the state change
-        self.log_event(f"INFO: Relay {relay_id} set to {state}")
-        
-        # Save states after change
-        self.save_relay_states()
-        
-        return True
+        return self.apply_relays({relay_id: state}) is not None
 
     def set_all_relays(self, state):
         """
         Set all relays to a specific state
-        :param state: Boolean state (True/False)
+        :param state: State string ("0"/"1")
+        :return: Boolean indicating success
         """
-        for relay_id in self.relays:
-            self.set_relay(relay_id, state)
-        
-        self.log_event(f"INFO: All relays set to {state}")
+        changes = {relay_id: state for relay_id in self.relays}
+        return self.apply_relays(changes) is not None
+
+    @metrics.timed("apply_relays")
+    def apply_relays(self, changes, reason=None):
+        """
+        Apply a batch of relay changes: pins are switched back to back,
+        states are saved once (by the store task) and a single summary
+        event is logged. The event always lists the applied states, so
+        switch history can be rebuilt from the event log.
+        :param changes: Dict relay_id -> state ("0"/"1", 0/1 or bool)
+        :param reason: Optional origin of the change, appended to the event
+        :return: Dict of applied states, or None if the batch is empty or invalid
+        """
+        if not changes:
+            return None
+        values = {}
+        for relay_id, state in changes.items():
+            relay_id = str(relay_id)
+            if relay_id not in self.relays:
+                self.log_event(f"ERROR: Invalid relay ID : {relay_id}. Must be between 1..8")
+                return None
+            if state in ("0", "1"):
+                values[relay_id] = state == "1"
+            elif state in (0, 1):
+                values[relay_id] = bool(state)
+            else:
+                self.log_event(f"ERROR: Invalid state : {state} for relay ID : {relay_id}. Must be 1 or 0")
+                return None
+
+        # Set physical relay states
+        for relay_id, value in values.items():
+            self.relays[relay_id].value(value)
+
+        # Update state tracking (flushed to flash by the store task)
+        for relay_id, value in values.items():
+            self.store.set(relay_id, value)
 
+        # Wake the control channels pushing the new state
+        for changed in self.listeners:
+            changed.set()
+
+        # Log the state change (the states first: long reasons are truncated, not the states)
+        states = set(values.values())
+        if reason is None and len(values) == 1:
+            relay_id, value = list(values.items())[0]
+            message = f"INFO: Relay {relay_id} set to {int(value)}"
+        elif reason is None and len(values) == len(self.relays) and len(states) == 1:
+            message = f"INFO: All relays set to {int(states.pop())}"
+        else:
+            message = "INFO: Relays set " + " ".join(f"{k}={int(v)}" for k, v in sorted(values.items()))
+            if reason:
+                message += f" ({reason})"
+        self.log_event(message)
+
+        return values
+
+    def apply_mask(self, mask, values, reason=None):
+        """
+        Apply a bitmask command through the batch path
+        :return: Dict of applied states, or None if the batch is invalid
+        """
+        return self.apply_relays(self.mask_to_changes(mask, values), reason)
+
+    @staticmethod
+    def mask_to_changes(mask, values):
+        """
+        Convert a bitmask command into a changes dict
+        :param mask: Bit i set means relay i+1 is changed
+        :param values: Bit i gives the new state of relay i+1
+        """
+        changes = {}
+        for relay_id in Config.RELAY_PINS:
+            bit = 1 << (int(relay_id) - 1)
+            if mask & bit:
+                changes[relay_id] = 1 if values & bit else 0
+        return changes
+
+    @metrics.timed("log_event")
     def log_event(self, message):
         """
         Log system events with timestamp
-        Maintains a rolling buffer of events
-        """
-        # Implement event logging logic similar to original code
-        # This is a placeholder - you may want to implement full logging
-        event = {
-                'message': message,
-                'time': "{:02d}:{:02d}:{:02d}".format(*localtime()[3:6]),
-                'date': "{:02d}/{:02d}/{}".format(localtime()[2], localtime()[1], localtime()[0])  # jour/mois/année
-            }
-        
-        if len(self.events) > Config.MAX_EVENTS :
-            self.events.pop(0)
-
-        self.events.insert(0, event)
-        self.save_events()
+        Appends one record to the ring-buffer event log
+        """
+        level, text = parse_level(message)
+        if self._boot_events is not None:
+            # event log not loaded yet (boot): written by load_event_log()
+            self._boot_events.append((level, text, int(time.time())))
+        else:
+            try:
+                self.event_log.append(level, text)
+            except OSError:
+                print("ERROR: Failed to write event log")
         print(message)
 
+    @metrics.timed("get_system_info")
     def get_system_info(self):
         """
-        Collect and return system information
+        Collect and return system information (from the latest telemetry sample)
         """
-        def read_temperature():
-            sensor_temp = ADC(4)
-            conversion_factor = 3.3 / (65535)
-            reading = sensor_temp.read_u16() * conversion_factor 
-            temperature = 27 - (reading - 0.706)/0.001721
-            
-            return f"{temperature:.2f}"
-
-        def read_voltage():
-            vsys = ADC(29)
-            conversion_factor = 3 * 3.3 / 65535
-            voltage = vsys.read_u16() * conversion_factor * 100
-            return f"{voltage:.2f}"
-
-        current_time = localtime()
+        sample = self.telemetry.latest()
+        current_time = localtime(sample['time'])
         return {
-            'ip_address': mm_wlan.get_ip(),
+            'ip_address': self.get_ip(),
             'ssid': ssid,
-            'free_memory': f"{(gc.mem_alloc() + gc.mem_free())/1000:.0f}",
-            'memory': f"{(gc.mem_free()/1000):.0f}",
-            'allocated_memory' : f"{(gc.mem_alloc()/1000):.0f}",
-            'temperature': read_temperature(),
-            'voltage': read_voltage(), 
+            'free_memory': f"{(sample['mem_alloc'] + sample['mem_free'])/1000:.0f}",
+            'memory': f"{(sample['mem_free']/1000):.0f}",
+            'allocated_memory' : f"{(sample['mem_alloc']/1000):.0f}",
+            'temperature': f"{sample['temperature']:.2f}",
+            'voltage': f"{sample['voltage']:.2f}", 
             'time': f"{current_time[3]:02d}:{current_time[4]:02d}:{current_time[5]:02d}",
             'date': f"{current_time[2]:02d}.{current_time[1]:02d}.{current_time[0]}",
             'location': location,
-            'contact': contact
+            'contact': contact,
+            'boot_ms': boot.to_dict()
         }
 
 def create_app(PicoBoardRelay):
     """Factory function to create Microdot application"""
     from microdot import Microdot
+    from microdot.websocket import with_websocket
     app = Microdot()
 
-    @app.route('/relays')
+    def route(url, methods=None):
+        """
+        app.route recording latency and heap allocation per request.
+        Generator bodies are measured until their last chunk is sent.
+        """
+        def decorator(handler):
+            def wrapper(request, *args, **kwargs):
+                name = request.method + " " + url
+                started = time.ticks_ms()
+                baseline = gc.mem_alloc()
+                try:
+                    response = handler(request, *args, **kwargs)
+                except Exception:
+                    metrics.observe("route", name, time.ticks_diff(time.ticks_ms(), started),
+                                    gc.mem_alloc() - baseline, True)
+                    raise
+                if isinstance(response, tuple) and hasattr(response[0], '__next__'):
+                    return (streamed(response[0], name, started, baseline),) + response[1:]
+                allocated = gc.mem_alloc() - baseline
+                metrics.observe("route", name, time.ticks_diff(time.ticks_ms(), started),
+                                allocated, False, allocated)
+                return response
+            return app.route(url, methods=methods)(wrapper)
+        return decorator
+
+    def streamed(body, name, started, baseline):
+        """
+        Pass a generator body through to the socket, tracking the peak heap
+        growth of the request. Once the chunks sent have allocated more than
+        STREAM_ALLOC_LIMIT bytes their garbage is collected, which bounds the
+        peak whatever the response size.
+        """
+        mark = baseline
+        allocated = peak = 0
+        error = True
+        try:
+            for chunk in body:
+                yield chunk
+                current = gc.mem_alloc()
+                if current - baseline > peak:
+                    peak = current - baseline
+                if current - mark > Config.STREAM_ALLOC_LIMIT:
+                    allocated += current - mark
+                    gc.collect()
+                    mark = gc.mem_alloc()
+            error = False
+        finally:
+            allocated += max(0, gc.mem_alloc() - mark)
+            metrics.observe("route", name, time.ticks_diff(time.ticks_ms(), started),
+                            allocated, error, peak)
+
+    def conditional(request, etag, render, headers=None):
+        """
+        Answer If-None-Match with 304 and no body; otherwise render the JSON body.
+        Validators: relay mask, newest event seq, telemetry sample time.
+        """
+        headers = headers or {}
+        headers["ETag"] = etag
+        if request.headers.get('If-None-Match') == etag:
+            return '', 304, headers
+        headers["Content-Type"] = "application/json"
+        return render(), headers
+
+    @route('/relays')
     def get_relay_states(request):
         """Get the current state of all relays"""
-        return json.dumps(PicoBoardRelay.relay_states), {"Content-Type": "application/json"}
+        store = PicoBoardRelay.store
+        return conditional(request, f'"r{store.mask}"', lambda: json_object(
+            (relay_id, store.get(relay_id)) for relay_id in Config.RELAY_PINS))
+
+    @route('/relays', methods=['POST'])
+    def set_relay_batch(request):
+        """
+        Apply several relay changes in one command.
+        Body: {"1": 1, "3": 0, ...} or {"mask": <bits>, "values": <bits>}
+        """
+        try:
+            body = request.json
+            if not isinstance(body, dict):
+                return json.dumps({"error": "Invalid command"}), 400, {"Content-Type": "application/json"}
+            if "mask" in body:
+                changes = PicoBoardRelay.mask_to_changes(int(body["mask"]), int(body.get("values", 0)))
+            else:
+                changes = body
+            applied = PicoBoardRelay.apply_relays(changes)
+            if applied is None:
+                return json.dumps({"error": "Invalid command"}), 400, {"Content-Type": "application/json"}
+            return json.dumps(PicoBoardRelay.relay_states), {"Content-Type": "application/json"}
+        except (ValueError, TypeError) as e:
+            # invalid JSON body, non-integer mask/values
+            return json.dumps({"error": str(e)}), 400, {"Content-Type": "application/json"}
+        except Exception as e:
+            return json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"}
 
-    @app.route('/relay/<id>/<state>', methods=['GET', 'POST'])
+    @route('/relay/<id>/<state>', methods=['GET', 'POST'])
     def control_relay(request, id, state):
         """Control a specific relay"""
         try:
-            # Convert state to boolean
-            relay_state = state == "1"
-            success = PicoBoardRelay.set_relay(id, relay_state)
+            success = PicoBoardRelay.set_relay(id, state)
             
             if success:
-                return json.dumps({f'Relay{id}': relay_state}), {"Content-Type": "application/json"}
+                return json.dumps({f'Relay{id}': state == "1"}), {"Content-Type": "application/json"}
             else:
-                return json.dumps({"error": "Invalid command"}), {"status": 400, "Content-Type": "application/json"}
+                return json.dumps({"error": "Invalid command"}), 400, {"Content-Type": "application/json"}
         except Exception as e:
-            return json.dumps({"error": str(e)}), {"status": 500, "Content-Type": "application/json"}
+            return json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"}
 
-    @app.route('/allrelays/<state>', methods=['GET', 'POST'])
+    @route('/allrelays/<state>', methods=['GET', 'POST'])
     def control_all_relays(request, state):
         """Control all relays simultaneously"""
         try:
-            relay_state = state == "1"
-            PicoBoardRelay.set_all_relays(relay_state)
+            if not PicoBoardRelay.set_all_relays(state):
+                return json.dumps({"error": "Invalid command"}), 400, {"Content-Type": "application/json"}
             return json.dumps(f"All relays set to {state}"), {"Content-Type": "application/json"}
         except Exception as e:
-            return json.dumps({"error": str(e)}), {"status": 500, "Content-Type": "application/json"}
+            return json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"}
 
-    @app.route('/system')
+    @route('/system')
     def system_info(request):
-        """Get system information"""
-        return json.dumps(PicoBoardRelay.get_system_info()), {"Content-Type": "application/json"}
+        """Get system information (changes once per telemetry sample)"""
+        etag = f'"s{PicoBoardRelay.telemetry.latest()["time"]}-{len(boot.phases)}"'
+        return conditional(request, etag, lambda: json_object(PicoBoardRelay.get_system_info().items()))
+
+    @route('/system/history')
+    def system_history(request):
+        """Get min/avg/max telemetry buckets: /system/history?resolution=<seconds>"""
+        try:
+            resolution = int(request.args.get('resolution', 60))
+        except ValueError:
+            return json.dumps({"error": "Invalid resolution"}), 400, {"Content-Type": "application/json"}
+        history = {
+            'interval': PicoBoardRelay.telemetry.interval_s,
+            'buckets': PicoBoardRelay.telemetry.history(resolution)
+        }
+        return json.dumps(history), {"Content-Type": "application/json"}
 
-    @app.route('/reboot', methods=['GET', 'POST'])
+    @route('/reboot', methods=['GET', 'POST'])
     def system_reboot(request):
         """Perform system reboot"""
         PicoBoardRelay.log_event("INFO: Pico System reboot initiated")
+        PicoBoardRelay.save_relay_states()
         reset()
 
     
-    @app.route("/events", methods=['GET', 'POST'])
+    @route("/events", methods=['GET', 'POST'])
     def events(request):
+        """
+        Get events newest first: /events?since=<seq>&limit=<n>
+        The X-Event-Seq header carries the newest sequence number on the board
+        """
+        try:
+            since = int(request.args.get('since', 0))
+            limit = request.args.get('limit')
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            return json.dumps({"error": "Invalid cursor"}), 400, {"Content-Type": "application/json"}
+
+        last_seq = PicoBoardRelay.event_log.last_seq
+        return conditional(request, f'"e{last_seq}"',
+                           lambda: json_array(EventLog.to_json(record) for record
+                                              in PicoBoardRelay.event_log.records(since, limit)),
+                           {"X-Event-Seq": str(last_seq)})
+
+    def socket_command(message):
+        """
+        Run one control channel command
+        :return: The JSON acknowledgement, carrying the command id
+        """
+        started = time.ticks_ms()
+        allocated = gc.mem_alloc()
+        command_id = cmd = None
+        error = True
+        try:
+            command = json.loads(message)
+            command_id, cmd = command.get('id'), command.get('cmd')
+            if cmd == 'relays':
+                changes = command.get('changes')
+                if isinstance(changes, dict) and "mask" in changes:
+                    changes = PicoBoardRelay.mask_to_changes(int(changes["mask"]), int(changes.get("values", 0)))
+                if not isinstance(changes, dict) or PicoBoardRelay.apply_relays(changes) is None:
+                    return json.dumps({"id": command_id, "ok": False, "error": "Invalid command"})
+            elif cmd != 'state':
+                return json.dumps({"id": command_id, "ok": False, "error": "Unknown command"})
+            error = False
+            return json.dumps({"id": command_id, "ok": True, "relays": PicoBoardRelay.relay_states})
+        except (ValueError, TypeError, AttributeError) as e:
+            return json.dumps({"id": command_id, "ok": False, "error": str(e)})
+        finally:
+            # fixed series names: a client must not create series at will
+            name = f"WS {cmd}" if cmd in ('relays', 'state') else "WS unknown"
+            metrics.observe("route", name, time.ticks_diff(time.ticks_ms(), started),
+                            gc.mem_alloc() - allocated, error)
+
+    async def push_states(ws, changed):
+        """Send the relay states to a control channel each time they change"""
+        while True:
+            await changed.wait()
+            changed.clear()
+            await ws.send(json.dumps({"event": "relays", "relays": PicoBoardRelay.relay_states}))
+
+    @app.route('/ws')
+    @with_websocket
+    async def control_socket(request, ws):
+        """
+        Long-lived control channel (JSON text frames). Commands carry an id
+        echoed in their acknowledgement, so several can be in flight:
+        {"id": 1, "cmd": "relays", "changes": {"1": 1, "3": 0}}   (or {"mask": .., "values": ..})
+        {"id": 2, "cmd": "state"}
+        -> {"id": 1, "ok": true, "relays": {...}} or {"id": 1, "ok": false, "error": "..."}
+        State changes from any source are pushed as {"event": "relays", "relays": {...}}
+        """
+        if len(PicoBoardRelay.listeners) >= Config.MAX_CONTROL_SOCKETS:
+            await ws.close()
+            return
+        changed = asyncio.Event()
+        PicoBoardRelay.listeners.append(changed)
+        pusher = asyncio.create_task(push_states(ws, changed))
+        try:
+            while True:
+                message = await ws.receive()
+                await ws.send(socket_command(message))
+        finally:
+            pusher.cancel()
+            PicoBoardRelay.listeners.remove(changed)
+
+    @route('/schedule')
+    def schedule_list(request):
+        """List scheduled jobs, with the board time they are computed against"""
+        return json.dumps({'now': int(time.time()), 'jobs': PicoBoardRelay.scheduler.list()}), \
+            {"Content-Type": "application/json"}
+
+    @route('/schedule', methods=['POST'])
+    def schedule_add(request):
+        """
+        Create a job, e.g. relay 3 on at 06:30 for 20 minutes on weekdays:
+        {"kind": "daily", "time": "06:30", "days": [0, 1, 2, 3, 4], "relays": {"3": 1}, "duration": 1200}
+        """
+        try:
+            job = PicoBoardRelay.scheduler.add(request.json)
+        except (ValueError, TypeError) as e:
+            return json.dumps({"error": str(e)}), 400, {"Content-Type": "application/json"}
+        except OSError as e:
+            return json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"}
+        PicoBoardRelay.log_event(f"INFO: Schedule job {job['id']} created")
+        return json.dumps(job), 201, {"Content-Type": "application/json"}
 
-        return  json.dumps(PicoBoardRelay.events), {"Content-Type": "application/json"}
+    @route('/schedule/<int:job_id>', methods=['PUT'])
+    def schedule_update(request, job_id):
+        """Replace a job (same body as creation)"""
+        try:
+            job = PicoBoardRelay.scheduler.update(job_id, request.json)
+        except (ValueError, TypeError) as e:
+            return json.dumps({"error": str(e)}), 400, {"Content-Type": "application/json"}
+        except OSError as e:
+            return json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"}
+        if job is None:
+            return json.dumps({"error": "Unknown job"}), 404, {"Content-Type": "application/json"}
+        PicoBoardRelay.log_event(f"INFO: Schedule job {job_id} updated")
+        return json.dumps(job), {"Content-Type": "application/json"}
+
+    @route('/schedule/<int:job_id>', methods=['DELETE'])
+    def schedule_remove(request, job_id):
+        """Delete a job"""
+        try:
+            removed = PicoBoardRelay.scheduler.remove(job_id)
+        except OSError as e:
+            return json.dumps({"error": str(e)}), 500, {"Content-Type": "application/json"}
+        if not removed:
+            return json.dumps({"error": "Unknown job"}), 404, {"Content-Type": "application/json"}
+        PicoBoardRelay.log_event(f"INFO: Schedule job {job_id} deleted")
+        return json.dumps({"deleted": job_id}), {"Content-Type": "application/json"}
+
+    @route('/metrics')
+    def metrics_text(request):
+        """Latency histograms and resource gauges in Prometheus text format"""
+        gauges = {
+            'mem_free_bytes': gc.mem_free(),
+            'mem_alloc_bytes': gc.mem_alloc(),
+            'relays_mask': PicoBoardRelay.store.mask,
+            'event_seq': PicoBoardRelay.event_log.last_seq,
+            'scheduled_jobs': len(PicoBoardRelay.scheduler.jobs),
+        }
+        return metrics.render(gauges), {"Content-Type": "text/plain; version=0.0.4"}
 
     return app
 
+async def serve(PicoBoard, app, port=80):
+    """
+    Run the Microdot server alongside the board background tasks.
+    The server is started first; the event log is loaded and the WiFi
+    connected while it is already listening.
+    """
+    server = asyncio.create_task(app.start_server(host="0.0.0.0", port=port, debug=True))
+    await asyncio.sleep(0)
+    boot.mark("server")
+    PicoBoard.load_event_log()
+    asyncio.create_task(PicoBoard.connect_wifi())
+    asyncio.create_task(PicoBoard.store.run(PicoBoard._on_store_error))
+    asyncio.create_task(PicoBoard.telemetry.run())
+    asyncio.create_task(PicoBoard.scheduler.run(on_error=PicoBoard._on_scheduler_error))
+    await server
+
 def main():
     """Main application entry point"""
   
-    # Create Pico relay board system
+    # Create Pico relay board system (relay outputs are restored first)
     PicoBoard = PicoBoardRelay()
 
-    # Initialize WiFi
-    mm_wlan.connect_to_network(ssid, pwd)
-    if not mm_wlan.is_connected():
-        print("Failed to connect to WiFi")
-        PicoBoard.log_event(f"WARNING: Failed to connect to WiFi")
-        return
-    PicoBoard.log_event(f"INFO: Wifi connected")
-
-    # Create and run application
+    # Create and run application, the WiFi connects once the server is up
     app = create_app(PicoBoard)
+    boot.mark("app")
     PicoBoard.log_event(f"INFO: Application started. Welcome !")
     try:
-        PicoBoard.led_rgb[0] = Config.COLORS["GREEN"] 
-        PicoBoard.led_rgb.write()
-        app.run(host="0.0.0.0", port=80, debug=True)
+        asyncio.run(serve(PicoBoard, app))
     except Exception as e:
         
         PicoBoard.log_event(f"WARNING: Application startup failed: {e}")
@@ -284,6 +1534,7 @@ def main():
         PicoBoard.led_rgb.write()
         time.sleep(3)
     finally :
+        PicoBoard.save_relay_states()
         PicoBoard.led_rgb[0] = Config.COLORS["OFF"] 
         PicoBoard.led_rgb.write()
         PicoBoard.log_event(f"INFO: Application stopped. Bye !")
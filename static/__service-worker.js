@@ -1,26 +1,49 @@
 //--------------------------------------------------------------------------
-// You can find dozens of practical, detailed, and working examples of 
+// You can find dozens of practical, detailed, and working examples of
 // service worker usage on https://github.com/mozilla/serviceworker-cookbook
 //--------------------------------------------------------------------------
 
+// Precache manifest, prepended by the gateway (see precache_manifest() in app.py)
+var MANIFEST = self.__PRECACHE_MANIFEST || {
+  version: 'dev', assets: [], external: [], cache_pages: false, pages: [], page_max_age: 30, api: {}
+};
+
 // Version
-var VERSION = '2.2.1'
+var VERSION = MANIFEST.version;
 
-// Cache name
-var CACHE_NAME = 'cache-version-' + VERSION;
+// Cache names: one for versioned assets, one for pages and API responses
+var CACHE_PREFIX = 'pico-';
+var STATIC_CACHE = CACHE_PREFIX + 'static-' + VERSION;
+var RUNTIME_CACHE = CACHE_PREFIX + 'runtime-' + VERSION;
+var CACHES = [STATIC_CACHE, RUNTIME_CACHE];
 
-// Files
-var REQUIRED_FILES = [
-  'index.html'
+// Hosts of the CDN libraries: anything fetched from them is treated as an asset
+var CDN_HOSTS = [
+  'cdn.jsdelivr.net', 'unpkg.com', 'cdnjs.cloudflare.com',
+  'fonts.googleapis.com', 'fonts.gstatic.com'
 ];
 
+// Header recording when a page or API response was cached
+var CACHED_AT = 'sw-cached-at';
+
 self.addEventListener('install', function (event) {
-  // Perform install step:  loading each required file into cache
+  // Perform install step: loading the dashboard assets into cache.
+  // Local assets are required, CDN files and pages are best effort.
   event.waitUntil(
-    caches.open(CACHE_NAME)
+    caches.open(STATIC_CACHE)
       .then(function (cache) {
-        // Add all offline dependencies to the cache
-        return cache.addAll(REQUIRED_FILES);
+        return cache.addAll(MANIFEST.assets).then(function () {
+          return Promise.all(MANIFEST.external.map(function (url) {
+            return cache.add(url).catch(function () {});
+          }));
+        });
+      })
+      .then(function () {
+        return Promise.all(MANIFEST.pages.map(function (url) {
+          return fetch(url, { credentials: 'same-origin' })
+            .then(function (response) { return putStamped(url, response); })
+            .catch(function () {});
+        }));
       })
       .then(function () {
         return self.skipWaiting();
@@ -28,23 +51,124 @@ self.addEventListener('install', function (event) {
   );
 });
 
+self.addEventListener('activate', function (event) {
+  // Remove the caches of previous versions, then take control of open pages
+  event.waitUntil(
+    caches.keys()
+      .then(function (names) {
+        return Promise.all(names.map(function (name) {
+          if (name.indexOf(CACHE_PREFIX) === 0 && CACHES.indexOf(name) === -1) {
+            return caches.delete(name);
+          }
+          // Caches created by the first versions of this worker
+          if (name.indexOf('cache-version-') === 0) {
+            return caches.delete(name);
+          }
+        }));
+      })
+      .then(function () {
+        return self.clients.claim();
+      })
+  );
+});
+
 self.addEventListener('fetch', function (event) {
-  event.respondWith(
-    caches.match(event.request)
-      .then(function (response) {
-        // Cache hit - return the response from the cached version
-        if (response) {
-          return response;
+  var request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+  var url = new URL(request.url);
+
+  if (url.origin === self.location.origin) {
+    if (url.pathname in MANIFEST.api) {
+      event.respondWith(staleWhileRevalidate(event, MANIFEST.api[url.pathname]));
+    } else if (MANIFEST.cache_pages && (request.mode === 'navigate' || MANIFEST.pages.indexOf(url.pathname) !== -1)) {
+      // Pages are cached by URL: only done with a single board, the board
+      // of a session not being part of the URL
+      event.respondWith(staleWhileRevalidate(event, MANIFEST.page_max_age));
+    } else if (url.pathname.indexOf('/static/') === 0 || MANIFEST.assets.indexOf(url.pathname) !== -1) {
+      event.respondWith(cacheFirst(event));
+    }
+    // Anything else (commands, /stream, /metrics...) goes to the network
+  } else if (CDN_HOSTS.indexOf(url.hostname) !== -1) {
+    event.respondWith(cacheFirst(event));
+  }
+});
+
+// Assets: answer from the cache, refresh the cached copy in the background
+function cacheFirst(event) {
+  return caches.open(STATIC_CACHE).then(function (cache) {
+    return cache.match(event.request, { ignoreSearch: isLocal(event.request) }).then(function (cached) {
+      var update = fetch(event.request).then(function (response) {
+        if (response.ok || response.type === 'opaque') {
+          return cache.put(event.request, response.clone()).then(function () {
+            return response;
+          });
         }
-        // Not in cache - return the result from the live server
-        // `fetch` is essentially a "fallback"
-        return fetch(event.request);
+        return response;
+      });
+      if (cached) {
+        event.waitUntil(update.catch(function () {}));
+        return cached;
       }
-      )
-  );
-});
+      return update;
+    });
+  });
+}
 
-self.addEventListener('activate', function (event) {
-  // Calling claim() to force a "controllerchange" event on navigator.serviceWorker
-  event.waitUntil(self.clients.claim());
-});
\ No newline at end of file
+// Pages and API: answer from the cache, revalidate once older than maxAge seconds.
+// Without a cached copy the network answers; offline, any cached page is used.
+function staleWhileRevalidate(event, maxAge) {
+  var request = event.request;
+  return caches.open(RUNTIME_CACHE).then(function (cache) {
+    return cache.match(request).then(function (cached) {
+      if (cached && cachedAge(cached) <= maxAge) {
+        return cached;
+      }
+      var update = fetch(request).then(function (response) {
+        return putStamped(request, response.clone()).then(function () {
+          return response;
+        });
+      });
+      if (cached) {
+        event.waitUntil(update.catch(function () {}));
+        return cached;
+      }
+      return update.catch(function (error) {
+        if (request.mode !== 'navigate') {
+          throw error;
+        }
+        return cache.match('/relais').then(function (page) {
+          if (page) {
+            return page;
+          }
+          throw error;
+        });
+      });
+    });
+  });
+}
+
+// Store a page or API response with the time it was fetched
+function putStamped(request, response) {
+  if (!response.ok || response.redirected) {
+    return Promise.resolve();
+  }
+  return response.blob().then(function (body) {
+    var headers = new Headers(response.headers);
+    headers.set(CACHED_AT, String(Date.now()));
+    return caches.open(RUNTIME_CACHE).then(function (cache) {
+      return cache.put(request, new Response(body, {
+        status: response.status, statusText: response.statusText, headers: headers
+      }));
+    });
+  });
+}
+
+function cachedAge(response) {
+  return (Date.now() - Number(response.headers.get(CACHED_AT) || 0)) / 1000;
+}
+
+function isLocal(request) {
+  return new URL(request.url).origin === self.location.origin;
+}
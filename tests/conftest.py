@@ -0,0 +1,54 @@
+"""
+Fixtures running main.py on the emulated Pico (see emulator/), with the
+flash files in a temporary directory
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emulator import install
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    install()
+    monkeypatch.chdir(tmp_path)
+    import main
+    return main
+
+
+@pytest.fixture
+def scheduler(main):
+    applied = []
+    scheduler = main.Scheduler("schedule.dat", lambda mask, values, message=None:
+                               applied.append((mask, values, message)))
+    scheduler.applied = applied
+    return scheduler
+
+
+@pytest.fixture
+def pico(tmp_path, monkeypatch):
+    from emulator.runner import EmulatedPico
+    monkeypatch.chdir(tmp_path)
+    pico = EmulatedPico(flash_dir=str(tmp_path)).start().wait_ready()
+    yield pico
+    pico.stop()
+
+
+@pytest.fixture
+def gateway_module(tmp_path, monkeypatch):
+    """app.py, with its history in tmp_path"""
+    monkeypatch.setenv("PICO_HISTORY_DB", str(tmp_path / "history.db"))
+    import app
+    return app
+
+
+@pytest.fixture
+def gateway(pico, gateway_module, monkeypatch):
+    """app.py pointed at the emulated Pico"""
+    monkeypatch.setattr(gateway_module, "fleet", gateway_module.Fleet({"pico": pico.url}))
+    return gateway_module
@@ -0,0 +1,40 @@
+import pytest
+import requests
+
+
+@pytest.mark.parametrize("path", ["/relays", "/events", "/system"])
+def test_matching_etag_gets_an_empty_304(pico, path):
+    first = requests.get(pico.url + path, timeout=3)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    again = requests.get(pico.url + path, headers={"If-None-Match": etag}, timeout=3)
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+    stale = requests.get(pico.url + path, headers={"If-None-Match": '"stale"'}, timeout=3)
+    assert stale.status_code == 200
+    assert stale.json() == first.json()
+
+
+@pytest.mark.parametrize("path", ["/relays", "/events"])
+def test_switching_changes_the_etag(pico, path):
+    etag = requests.get(pico.url + path, timeout=3).headers["ETag"]
+    requests.post(pico.url + "/relays", json={"2": 1}, timeout=3)
+    response = requests.get(pico.url + path, headers={"If-None-Match": etag}, timeout=3)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_event_seq_header_on_304(pico):
+    first = requests.get(pico.url + "/events", timeout=3)
+    again = requests.get(pico.url + "/events", headers={"If-None-Match": first.headers["ETag"]}, timeout=3)
+    assert again.status_code == 304
+    assert again.headers["X-Event-Seq"] == first.headers["X-Event-Seq"] == str(pico.board.event_log.last_seq)
+
+
+def test_gateway_reuses_its_copy_on_304(gateway, pico):
+    client = gateway.fleet.boards["pico"].client
+    first = client.get("/relays")
+    assert client.get("/relays") is first
+    requests.post(pico.url + "/relays", json={"2": 1}, timeout=3)
+    assert client.get("/relays").json()["2"] is True
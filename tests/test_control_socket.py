@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+websocket = pytest.importorskip("websocket")
+
+
+@pytest.fixture
+def ws(pico):
+    ws = websocket.create_connection("ws" + pico.url[4:] + "/ws", timeout=3)
+    yield ws
+    ws.close()
+
+
+def command(ws, **message):
+    ws.send(json.dumps(message))
+    while True:
+        reply = json.loads(ws.recv())
+        if "event" not in reply:
+            return reply
+
+
+def test_relays_command_is_acknowledged_with_states(pico, ws):
+    ack = command(ws, id=7, cmd="relays", changes={"3": 1})
+    assert ack["id"] == 7 and ack["ok"] and ack["relays"]["3"] is True
+    assert pico.board.relays["3"].value() == 1
+    ack = command(ws, id=8, cmd="relays", changes={"mask": 0b100, "values": 0})
+    assert ack["relays"]["3"] is False
+
+
+def test_rejected_commands(ws):
+    assert command(ws, id=1, cmd="relays", changes={"9": 1}) == \
+        {"id": 1, "ok": False, "error": "Invalid command"}
+    assert not command(ws, id=2, cmd="reboot")["ok"]
+
+
+def test_unknown_commands_share_one_metrics_series(pico, ws):
+    for n in range(5):
+        command(ws, id=n, cmd=f'bogus"{n}')
+    command(ws, id=9, cmd="state")
+    routes = {name for kind, name in pico.main.metrics.series if kind == "route"}
+    assert {"WS unknown", "WS state"} <= routes
+    assert not [name for name in routes if "bogus" in name]
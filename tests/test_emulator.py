@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def test_concurrent_commands_are_handled_one_at_a_time(pico):
+    first = pico.board.event_log.last_seq
+    count = 200
+
+    def toggle(i):
+        with requests.Session() as session:
+            return session.post(f"{pico.url}/relay/{i % 8 + 1}/{i % 2}", timeout=5).status_code
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert set(executor.map(toggle, range(count))) == {200}
+    # one event per command, none lost or overwritten (the ring keeps the last 50)
+    last = first + count
+    assert pico.board.event_log.last_seq == last
+    seqs = [record[0] for record in pico.board.event_log.records()]
+    assert seqs == list(range(last, last - pico.board.event_log.capacity, -1))
+
+
+def test_heap_allocations_are_measured(pico):
+    import gc
+    assert gc.mem_alloc() > 0
+    requests.get(pico.url + "/events", timeout=3)
+    text = requests.get(pico.url + "/metrics", timeout=3).text
+    allocated = [line for line in text.splitlines()
+                 if line.startswith('pico_route_alloc_bytes_total{route="GET /events"}')]
+    assert allocated and int(allocated[0].split()[-1]) > 0
@@ -0,0 +1,68 @@
+import json
+import os
+
+
+def messages(log, **kwargs):
+    return [record[3] for record in log.records(**kwargs)]
+
+
+def test_ring_overwrites_the_oldest_records(main):
+    log = main.EventLog("events.dat", 4)
+    log.load()
+    for n in range(1, 7):
+        log.append(0, f"event {n}", 1000 + n)
+    assert os.stat("events.dat")[6] == 4 * log.RECORD_SIZE
+    assert log.last_seq == 6
+    assert messages(log) == ["event 6", "event 5", "event 4", "event 3"]
+    assert messages(log, since=4) == ["event 6", "event 5"]
+    assert messages(log, since=1, limit=2) == ["event 4", "event 3"]
+
+
+def test_seq_continues_across_load(main):
+    log = main.EventLog("events.dat", 4)
+    log.load()
+    for n in range(1, 7):
+        log.append(0, f"event {n}", 1000 + n)
+
+    reloaded = main.EventLog("events.dat", 4)
+    reloaded.load()
+    assert reloaded.last_seq == 6
+    assert list(reloaded.records()) == list(log.records())
+    assert reloaded.append(1, "event 7", 1007)[0] == 7
+    assert messages(reloaded) == ["event 7", "event 6", "event 5", "event 4"]
+
+
+def test_invalid_file_is_formatted_again(main):
+    with open("events.dat", "wb") as f:
+        f.write(b"truncated")
+    log = main.EventLog("events.dat", 4)
+    log.load()
+    assert log.last_seq == 0
+    assert list(log.records()) == []
+    assert os.stat("events.dat")[6] == 4 * log.RECORD_SIZE
+
+
+def test_legacy_json_is_migrated_once(main):
+    legacy = [
+        {"message": "WARNING: newest", "date": "02/01/2024", "time": "10:00:00"},
+        {"message": "INFO: oldest", "date": "01/01/2024", "time": "09:30:00"},
+        {"message": "no level", "date": "garbage"},
+    ]
+    with open("events.json", "w") as f:
+        json.dump(legacy, f)
+    log = main.EventLog("events.dat", 4)
+    log.load()
+    log.migrate("events.json")
+    assert not os.path.exists("events.json")
+    assert [main.EventLog.to_dict(record)["message"] for record in log.records()] == [
+        "WARNING: newest", "INFO: oldest", "INFO: no level"]
+    newest = main.EventLog.to_dict(next(log.records()))
+    assert (newest["date"], newest["time"]) == ("02/01/2024", "10:00:00")
+    assert log.last_seq == 3
+
+    # a leftover file is dropped without duplicating events
+    with open("events.json", "w") as f:
+        json.dump(legacy, f)
+    log.migrate("events.json")
+    assert not os.path.exists("events.json")
+    assert log.last_seq == 3
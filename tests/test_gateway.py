@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+
+def wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+@pytest.mark.parametrize("channel", ["websocket", "http"])
+def test_relay_command_returns_relay_states(gateway, monkeypatch, channel):
+    board = gateway.fleet.boards["pico"]
+    if channel == "http":
+        monkeypatch.setattr(board.socket, "start", lambda: None)
+    else:
+        pytest.importorskip("websocket")
+        gateway.start_background()
+    client = gateway.app.test_client()
+    client.get("/get_relay_state")
+    assert wait_for(lambda: board.socket.connected) == (channel == "websocket")
+
+    response = client.post("/relay/4/1")
+    assert response.status_code == 200
+    states = response.get_json()
+    assert sorted(states, key=int) == [str(n) for n in range(1, 9)]
+    assert states["4"] is True
+
+
+@pytest.mark.parametrize("boards, cached", [({"pico": "http://a"}, True),
+                                            ({"pico": "http://a", "garage": "http://b"}, False)])
+def test_pages_are_cached_by_the_service_worker_with_a_single_board(gateway, monkeypatch, boards, cached):
+    monkeypatch.setattr(gateway, "BOARDS", boards)
+    manifest = gateway.precache_manifest()
+    assert manifest["cache_pages"] is cached
+    assert bool(manifest["pages"]) is cached and bool(manifest["api"]) is cached
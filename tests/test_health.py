@@ -0,0 +1,104 @@
+import time
+
+import pytest
+import requests
+
+
+class FakeSession(object):
+    """requests session answering from `self.ok`, counting the calls"""
+
+    def __init__(self):
+        self.ok = False
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if not self.ok:
+            raise requests.exceptions.ConnectionError("unreachable")
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = b"{}"
+        return response
+
+
+@pytest.fixture
+def health(gateway_module, monkeypatch):
+    health = gateway_module.PicoHealth(lambda: None, max_timeout=3, min_timeout=1,
+                                       threshold=3, cooldown=2, max_cooldown=6)
+    monkeypatch.setattr(health, "start", lambda: None)      # no monitoring thread
+    return health
+
+
+@pytest.fixture
+def client(gateway_module, monkeypatch):
+    client = gateway_module.PicoClient("http://pico.invalid")
+    monkeypatch.setattr(client.health, "start", lambda: None)
+    client.session = FakeSession()
+    return client
+
+
+def expire(health):
+    health.retry_at = time.monotonic() - 1
+
+
+def test_breaker_opens_after_threshold_and_fails_fast(gateway_module, client):
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.command("/relays")
+    assert client.health.state == client.health.OPEN
+    with pytest.raises(gateway_module.PicoUnavailable):
+        client.command("/relays")
+    assert client.session.calls == 3
+
+
+def test_single_probe_while_half_open(gateway_module, health):
+    for _ in range(3):
+        health.record(False)
+    expire(health)
+    assert health.acquire() == health.max_timeout
+    assert health.state == health.HALF_OPEN
+    with pytest.raises(gateway_module.PicoUnavailable):
+        health.acquire()
+
+
+def test_failed_probe_doubles_the_cooldown_up_to_the_maximum(health):
+    for _ in range(3):
+        health.record(False)
+    for cooldown in (4, 6, 6):
+        expire(health)
+        health.acquire()
+        health.record(False)
+        assert health.state == health.OPEN
+        assert health.cooldown == cooldown
+        assert health.retry_at - time.monotonic() == pytest.approx(cooldown, abs=0.5)
+
+
+def test_successful_probe_closes_and_resets_the_cooldown(client):
+    health = client.health
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.command("/relays")
+    expire(health)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.command("/relays")
+    assert health.cooldown == 2 * health.base_cooldown
+    expire(health)
+    client.session.ok = True
+    assert client.command("/relays") == {}
+    assert health.state == health.CLOSED
+    assert health.cooldown == health.base_cooldown
+    assert health.connected
+
+
+def test_timeout_adapts_to_the_observed_latency(health):
+    assert health.timeout == health.max_timeout
+    for _ in range(20):
+        health.record(True, 0.05)
+    assert health.timeout == health.min_timeout
+    for _ in range(20):
+        health.record(True, 0.2)
+        health.record(True, 1.0)
+    assert health.min_timeout < health.timeout < health.max_timeout
+    for _ in range(20):
+        health.record(True, 5)
+    assert health.timeout == health.max_timeout
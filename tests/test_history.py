@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from history import HistoryStore, parse_switches
+
+T0 = 1_700_000_000
+
+
+def event(seq, epoch, message):
+    t = time.gmtime(epoch)
+    return {"seq": seq, "message": message,
+            "date": time.strftime("%d/%m/%Y", t), "time": time.strftime("%H:%M:%S", t)}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.db"))
+
+
+@pytest.mark.parametrize("message, switches", [
+    ("INFO: Relay 3 set to 1", [(3, 1)]),
+    ("INFO: Relays set 1=1 3=0", [(1, 1), (3, 0)]),
+    ("INFO: Relays set 3=0 (schedule job 1 stopped)", [(3, 0)]),
+    ("INFO: Schedule start 2: relays set 5=1", [(5, 1)]),
+    ("INFO: All relays set to 0", [(relay, 0) for relay in range(1, 9)]),
+    ("INFO: Relay System Initialized", []),
+])
+def test_parse_switches(message, switches):
+    assert parse_switches(message) == switches
+
+
+def test_relay_stats(store):
+    store.add_events("pico", [
+        event(3, T0 + 300, "INFO: Relays set 2=0 (schedule job 1 stopped)"),
+        event(2, T0 + 100, "INFO: Relays set 2=1 (schedule start 1)"),
+        event(1, T0, "INFO: Relay 4 set to 1"),
+    ])
+    assert store.flush() == 3
+    stats = store.relay_stats("pico", T0, T0 + 1000)
+    assert stats["2"] == {"switches": 2, "on_time": 200}
+    assert stats["4"] == {"switches": 1, "on_time": 1000}
+    assert [e["seq"] for e in store.events("pico", relay=2)] == [3, 2]
+
+
+def test_scheduler_switches_are_recorded(pico, store):
+    """Relays released by deleting a running job end their on time in the history"""
+    now = int(time.time())
+    scheduler = pico.board.scheduler
+    scheduler.add({"kind": "interval", "start": now, "every": 3600, "duration": 600, "relays": {"6": 1}})
+    scheduler.fire(now)
+    scheduler.remove(1)
+    store.add_events("pico", pico.board.get_events())
+    store.flush()
+    stats = store.relay_stats("pico", now - 10, now + 3600)
+    assert stats["6"]["switches"] == 2
+    assert stats["6"]["on_time"] <= 2
+
+
+def test_history_events_limits_are_clamped(gateway):
+    client = gateway.app.test_client()
+    gateway.history.add_events(gateway.fleet.default, [event(seq, T0 + seq, f"INFO: Relay 1 set to {seq % 2}")
+                                      for seq in range(1, 6)])
+    for query, count in (("limit=-1", 1), ("limit=0", 1), ("limit=2&offset=-3", 2), ("limit=5000", 5)):
+        rows = client.get(f"/history/events?start={T0}&end={T0 + 100}&{query}").get_json()["events"]
+        assert len(rows) == count, query
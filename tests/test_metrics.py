@@ -0,0 +1,44 @@
+import requests
+
+SUFFIXES = {"histogram": ("_bucket", "_sum", "_count"), "counter": ("",), "gauge": ("",)}
+
+
+def families(text):
+    """Parse an exposition, checking that each family is one block under its TYPE line"""
+    parsed = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, metric_type = line.split()
+            assert family not in parsed, f"{family} split in several blocks"
+            parsed[family] = (metric_type, [])
+            continue
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        assert family is not None, f"{name} has no TYPE line"
+        metric_type, samples = parsed[family]
+        assert name in [family + suffix for suffix in SUFFIXES[metric_type]], f"{name} outside its family"
+        samples.append(line)
+    return parsed
+
+
+def test_pico_exposition_has_one_block_per_family(pico):
+    requests.get(pico.url + "/relays", timeout=3)
+    parsed = families(requests.get(pico.url + "/metrics", timeout=3).text)
+    assert parsed["pico_route_latency_ms"][0] == "histogram"
+    assert parsed["pico_route_errors_total"][0] == "counter"
+    assert parsed["pico_route_alloc_bytes_total"][0] == "counter"
+    assert parsed["pico_route_peak_alloc_bytes"][0] == "gauge"
+    assert parsed["pico_call_errors_total"][0] == "counter"
+
+
+def test_gateway_keeps_the_samples_of_all_boards_together(gateway, pico, monkeypatch):
+    monkeypatch.setattr(gateway, "fleet", gateway.Fleet({"a": pico.url, "b": pico.url}))
+    client = gateway.app.test_client()
+    client.get("/get_relay_state")
+    parsed = families(client.get("/metrics").get_data(as_text=True))
+    assert parsed["gateway_route_errors_total"][0] == "counter"
+    for family in ("gateway_board_up", "pico_route_errors_total", "pico_mem_free_bytes"):
+        metric_type, samples = parsed[family]
+        assert any('board="a"' in sample for sample in samples)
+        assert any('board="b"' in sample for sample in samples)
+    assert parsed["gateway_board_up"] == ("gauge", ['gateway_board_up{board="a"} 1', 'gateway_board_up{board="b"} 1'])
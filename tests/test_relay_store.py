@@ -0,0 +1,44 @@
+import asyncio
+import os
+
+import pytest
+
+
+@pytest.fixture
+def store(main):
+    return main.RelayStore("relay_states.dat", debounce_ms=0, max_delay_ms=0)
+
+
+def test_flush_and_load(main, store):
+    store.set("3", True)
+    assert store.dirty and store.flush()
+    assert not store.dirty and not store.flush()
+    restored = main.RelayStore("relay_states.dat")
+    assert restored.load() and restored.mask == 0b100
+
+
+def test_failed_flush_stays_dirty_and_is_retried(main, store, monkeypatch):
+    store.set("3", True)
+    rename = os.rename
+
+    def failing_rename(src, dst):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(os, "rename", failing_rename)
+    with pytest.raises(OSError):
+        store.flush()
+    assert store.dirty and store.due()
+
+    errors = []
+
+    async def run():
+        task = asyncio.create_task(store.run(errors.append, retry_s=0.1))
+        await asyncio.sleep(0.5)
+        monkeypatch.setattr(os, "rename", rename)
+        await asyncio.sleep(0.5)
+        task.cancel()
+
+    asyncio.run(run())
+    assert len(errors) == 1                 # reported once, retried until written
+    assert not store.dirty
+    restored = main.RelayStore("relay_states.dat")
+    assert restored.load() and restored.mask == 0b100
@@ -0,0 +1,33 @@
+import requests
+
+
+def test_batch_command(pico):
+    response = requests.post(pico.url + "/relays", json={"1": 1, "3": "1"}, timeout=3)
+    assert response.status_code == 200
+    assert response.json()["1"] is True and response.json()["3"] is True
+    response = requests.post(pico.url + "/relays", json={"mask": 0b101, "values": 0}, timeout=3)
+    assert response.json()["1"] is False and response.json()["3"] is False
+
+
+def test_invalid_batches_are_rejected(pico):
+    last_seq = pico.board.event_log.last_seq
+    for body in ({}, {"mask": "x"}, {"9": 1}, {"1": 2}, [1]):
+        response = requests.post(pico.url + "/relays", json=body, timeout=3)
+        assert response.status_code == 400, body
+    response = requests.post(pico.url + "/relays", data="{not json", timeout=3,
+                             headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+    # only the invalid relay id and state are logged, no empty "Relays set" event
+    messages = [record[3] for record in pico.board.event_log.records(last_seq)]
+    assert not [message for message in messages if message.startswith("Relays set")]
+
+
+def test_gateway_passes_rejections_through(gateway):
+    client = gateway.app.test_client()
+    board = gateway.fleet.boards["pico"]
+    board.socket.start = lambda: None      # HTTP path
+    response = client.post("/relay/9/1")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid command"}
+    response = client.post("/relays", json={})
+    assert response.status_code == 400
@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+
+def test_parse_daily(scheduler):
+    job = scheduler.parse({"kind": "daily", "time": "06:30", "days": [0, 4],
+                           "relays": {"3": 1, "5": 0}, "duration": 1200}, 1)
+    assert (job['kind'], job['start'], job['period']) == (1, 6 * 3600 + 30 * 60, 0b10001)
+    assert (job['mask'], job['values'], job['duration']) == (0b10100, 0b100, 1200)
+
+
+@pytest.mark.parametrize("body", [
+    {"kind": "weekly", "relays": {"1": 1}},
+    {"kind": "once", "start": 10},
+    {"kind": "once", "start": 10, "relays": {"9": 1}},
+    {"kind": "once", "start": 10, "relays": {"1": 2}},
+    {"kind": "daily", "time": "25:00", "relays": {"1": 1}},
+    {"kind": "daily", "time": "06:30", "days": [7], "relays": {"1": 1}},
+    {"kind": "interval", "start": 10, "every": 60, "duration": 60, "relays": {"1": 1}},
+    {"kind": "interval", "start": -10, "every": 60, "relays": {"1": 1}},
+    {"kind": "interval", "start": 10, "every": 2 ** 32, "relays": {"1": 1}},
+    {"kind": "once", "start": 2 ** 32, "relays": {"1": 1}},
+    {"kind": "once", "start": 10, "duration": 2 ** 32, "relays": {"1": 1}},
+    {"kind": "once", "start": 10, "duration": -1, "relays": {"1": 1}},
+])
+def test_parse_rejects_invalid_jobs(scheduler, body):
+    with pytest.raises(ValueError):
+        scheduler.parse(body, 1)
+
+
+def test_invalid_add_leaves_scheduler_untouched(scheduler):
+    with pytest.raises(ValueError):
+        scheduler.add({"kind": "once", "start": int(time.time()) + 60, "duration": 2 ** 32,
+                       "relays": {"1": 1}})
+    assert scheduler.jobs == {} and scheduler._heap == []
+    scheduler.add({"kind": "once", "start": int(time.time()) + 60, "relays": {"1": 1}})
+    assert list(scheduler.jobs) == [1]
+
+
+def test_fire_batches_due_jobs_and_removes_completed_once_jobs(main, scheduler):
+    now = int(time.time())
+    scheduler.add({"kind": "once", "start": now + 10, "relays": {"1": 1}})
+    scheduler.add({"kind": "once", "start": now + 10, "relays": {"2": 1}, "duration": 5})
+    assert scheduler.fire(now + 9) == ([], [])
+    assert scheduler.fire(now + 10) == ([1, 2], [])
+    assert scheduler.applied == [(0b11, 0b11, "schedule start 1,2")]
+    assert list(scheduler.jobs) == [2]
+    assert scheduler.fire(now + 15) == ([], [2])
+    assert scheduler.applied[-1] == (0b10, 0, "schedule end 2")
+    assert scheduler.jobs == {}
+
+    restored = main.Scheduler("schedule.dat", lambda *args: None)
+    assert restored.load() == 0
+
+
+def test_save_and_load(main, scheduler):
+    now = int(time.time())
+    scheduler.add({"kind": "interval", "start": now + 60, "every": 3600, "relays": {"4": 1}})
+    scheduler.add({"kind": "daily", "time": "07:15:30", "days": [5, 6], "relays": {"8": 0},
+                   "enabled": False})
+    restored = main.Scheduler("schedule.dat", lambda *args: None)
+    assert restored.load() == 2
+    assert restored.list() == scheduler.list()
+
+
+def test_removing_a_running_job_releases_its_relays(scheduler):
+    now = int(time.time())
+    scheduler.add({"kind": "interval", "start": now, "every": 3600, "duration": 600,
+                   "relays": {"3": 1}})
+    scheduler.fire(now + 1)
+    assert scheduler.remove(1)
+    mask, values, message = scheduler.applied[-1]
+    assert (mask, values & mask, message) == (0b100, 0, "schedule job 1 stopped")
+
+
+def test_run_survives_save_errors(scheduler):
+    errors = []
+    now = int(time.time())
+    scheduler.add({"kind": "once", "start": now + 1, "relays": {"1": 1}})
+    scheduler.add({"kind": "once", "start": now + 2, "relays": {"2": 1}})
+
+    def failing_save():
+        raise OSError("flash full")
+    scheduler.save = failing_save
+
+    async def run():
+        task = asyncio.create_task(scheduler.run(tick_s=0.05, on_error=errors.append))
+        await asyncio.sleep(3)
+        task.cancel()
+
+    asyncio.run(run())
+    assert [mask for mask, values, message in scheduler.applied] == [0b1, 0b10]
+    assert len(errors) == 2
+
+
+def test_failed_save_rolls_back_the_job_table(main, scheduler):
+    now = int(time.time())
+    scheduler.add({"kind": "interval", "start": now, "every": 3600, "duration": 600,
+                   "relays": {"3": 1}})
+    scheduler.fire(now + 1)
+    saved = scheduler.list()
+
+    def failing_save():
+        raise OSError("flash full")
+    scheduler.save = failing_save
+
+    with pytest.raises(OSError):
+        scheduler.add({"kind": "once", "start": now + 10, "relays": {"1": 1}})
+    with pytest.raises(OSError):
+        scheduler.update(1, {"kind": "once", "start": now + 10, "relays": {"2": 1}})
+    with pytest.raises(OSError):
+        scheduler.remove(1)
+    assert scheduler.list() == saved
+    assert len(scheduler.applied) == 1                  # the running job kept its relays
+    # queued actions of the rejected jobs are skipped, the kept job still ends
+    assert scheduler.fire(now + 600) == ([], [1])
+    assert main.Scheduler("schedule.dat", lambda *args: None).load() == 1
+
+
+def test_clock_jump_reschedules_jobs(scheduler, monkeypatch):
+    """Jobs added before NTP set the clock are rescheduled against the real time"""
+    now = int(time.time())
+    clock = [1_609_459_200]               # 2021-01-01, RTC after a power loss
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    scheduler.add({"kind": "daily", "time": "06:30", "relays": {"1": 1}})
+    assert scheduler._heap[0][0] < now
+
+    async def run():
+        task = asyncio.create_task(scheduler.run(tick_s=0.05))
+        await asyncio.sleep(0.1)
+        clock[0] = now                    # ntptime.settime()
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(run())
+    assert scheduler.applied == []
+    assert now < scheduler._heap[0][0] <= now + 86400
+
+
+def test_clock_is_set_from_ntp_after_wifi(pico):
+    import ntptime
+    assert ntptime.sync_count >= 1
+    assert "clock" in dict(pico.main.boot.phases)
+    messages = [record[3] for record in pico.board.event_log.records(limit=5)]
+    assert "Clock synchronized (NTP)" in messages
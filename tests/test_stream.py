@@ -0,0 +1,46 @@
+import time
+
+
+class FakeMirror(object):
+    """PicoMirror answering from in-memory relays and events"""
+
+    def __init__(self):
+        self.relays = {"1": False, "2": True}
+        self.events = [{"seq": 5, "message": "INFO: Relay 2 set to 1"}]
+
+    def refresh(self, name):
+        pass
+
+    def get(self, name):
+        return self.snapshot(name)
+
+    def snapshot(self, name):
+        return (dict(self.relays) if name == "relays" else list(self.events)), 0, True
+
+
+def queued(broker):
+    (subscriber,) = broker._subscribers
+    messages = []
+    while not subscriber.empty():
+        messages.append(subscriber.get_nowait())
+    return messages
+
+
+def test_first_poll_does_not_repeat_the_snapshot(gateway_module):
+    mirror = FakeMirror()
+    broker = gateway_module.StreamBroker(mirror, interval=0.05)
+    stream = broker.stream()
+    assert next(stream) == "retry: 5000\n\n"
+    assert next(stream) == 'event: status\ndata: {"connected": true}\n\n'
+    assert next(stream) == 'event: relays\ndata: {"1": false, "2": true}\n\n'
+    time.sleep(0.3)
+    assert queued(broker) == []
+
+    mirror.relays["1"] = True
+    mirror.events.insert(0, {"seq": 6, "message": "INFO: Relay 1 set to 1"})
+    time.sleep(0.3)
+    assert queued(broker) == [
+        'event: relays\ndata: {"1": true}\n\n',
+        'event: events\ndata: [{"seq": 6, "message": "INFO: Relay 1 set to 1"}]\n\n',
+    ]
+    stream.close()